@@ -1,16 +1,26 @@
-from typing import Any, Dict, List
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+import asyncio
+import bisect
 import json
 import os
+import time
 import chainlit as cl
 import tokeniser
 import litellm
-from linkup import LinkupClient
+from linkup import LinkupClient, LinkupTimeoutError
 
 MAX_CONTEXT_WINDOW_TOKENS = 70000
 DEFAULT_MODEL = "anthropic/claude-3-5-sonnet-20240620"
+SEARCH_TIMEOUT_SECONDS = 30
+SEARCH_CACHE_TTL_SECONDS = 600
+SEARCH_CACHE_SIZE = 256
 
 linkup_client = LinkupClient(api_key=os.environ["LINKUP_API_KEY"])
 
+# Shared by all sessions: (normalized query, depth) -> (fetched at, formatted results)
+search_cache: "OrderedDict[Tuple[str, str], Tuple[float, str]]" = OrderedDict()
+
 # Tool definitions
 SEARCH_TOOL = {
     "type": "function",
@@ -46,38 +56,148 @@ COMMANDS = [
 ]
 
 
-def truncate_messages(messages: List[Dict[str, Any]], max_tokens: int = MAX_CONTEXT_WINDOW_TOKENS) -> List[Dict[str, Any]]:
+def _field(obj: Any, name: str, default: Any = None) -> Any:
+    """Read a field from either an SDK object or a plain dict chunk"""
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+
+class StreamAccumulator:
+    """
+    Assembles a streamed completion into a single assistant turn.
+
+    Understands OpenAI/litellm chat chunks (`choices[0].delta` with `content`
+    and indexed `tool_calls` fragments) and Anthropic message stream events
+    (`content_block_start` / `content_block_delta` with text or
+    `input_json_delta`). Text and argument fragments are collected in lists
+    and joined once, so the cost is linear in the response size.
+    """
+
+    def __init__(self):
+        self._text_parts: List[str] = []
+        self._tool_calls: Dict[int, Dict[str, Any]] = {}
+
+    def add(self, chunk: Any) -> str:
+        """Consume one stream chunk and return the text it added (possibly empty)"""
+        if _field(chunk, "choices") is not None:
+            return self._add_chat_chunk(chunk)
+        return self._add_anthropic_event(chunk)
+
+    def _add_chat_chunk(self, chunk: Any) -> str:
+        choices = _field(chunk, "choices")
+        if not choices:
+            return ""
+        delta = _field(choices[0], "delta")
+        if delta is None:
+            return ""
+
+        for tool_call in _field(delta, "tool_calls") or []:
+            function = _field(tool_call, "function")
+            self._add_tool_fragment(
+                _field(tool_call, "index", 0),
+                _field(tool_call, "id"),
+                _field(function, "name") if function is not None else None,
+                (_field(function, "arguments") if function is not None else None) or "",
+            )
+
+        text = _field(delta, "content") or ""
+        if text:
+            self._text_parts.append(text)
+        return text
+
+    def _add_anthropic_event(self, event: Any) -> str:
+        event_type = _field(event, "type")
+        index = _field(event, "index", 0)
+        if event_type == "content_block_start":
+            block = _field(event, "content_block")
+            if _field(block, "type") == "tool_use":
+                self._add_tool_fragment(index, _field(block, "id"), _field(block, "name"), "")
+            elif _field(block, "type") == "text" and _field(block, "text"):
+                self._text_parts.append(_field(block, "text"))
+                return _field(block, "text")
+        elif event_type == "content_block_delta":
+            delta = _field(event, "delta")
+            if _field(delta, "type") == "text_delta":
+                text = _field(delta, "text") or ""
+                if text:
+                    self._text_parts.append(text)
+                return text
+            if _field(delta, "type") == "input_json_delta":
+                self._add_tool_fragment(index, None, None, _field(delta, "partial_json") or "")
+        return ""
+
+    def _add_tool_fragment(self, index: int, call_id: str, name: str, arguments: str):
+        tool_call = self._tool_calls.get(index)
+        if tool_call is None:
+            # Argument fragments can't be attributed before the call is named
+            if not name:
+                return
+            tool_call = self._tool_calls[index] = {"id": call_id, "name": name, "arguments": []}
+        if call_id and not tool_call["id"]:
+            tool_call["id"] = call_id
+        if arguments:
+            tool_call["arguments"].append(arguments)
+
+    @property
+    def text(self) -> str:
+        return "".join(self._text_parts)
+
+    @property
+    def tool_calls(self) -> Dict[int, Dict[str, Any]]:
+        """Completed tool calls by stream index: {"id", "name", "arguments" (JSON string)}"""
+        return {
+            index: {**tool_call, "arguments": "".join(tool_call["arguments"])}
+            for index, tool_call in self._tool_calls.items()
+        }
+
+
+class ChatHistory:
+    """
+    Conversation messages with their token counts cached at append time.
+
+    `prefix_tokens[k]` is the total token count of the first k messages, so the
+    token count of any contiguous window is a subtraction and the start of the
+    largest window that fits a budget is found by binary search.
+    """
+
+    def __init__(self):
+        self.messages: List[Dict[str, Any]] = []
+        self.prefix_tokens: List[int] = [0]
+
+    def __len__(self):
+        return len(self.messages)
+
+    def append(self, message: Dict[str, Any]):
+        tokens = tokeniser.estimate_tokens(message["content"])
+        self.messages.append(message)
+        self.prefix_tokens.append(self.prefix_tokens[-1] + tokens)
+
+
+def truncate_messages(history: ChatHistory, max_tokens: int = MAX_CONTEXT_WINDOW_TOKENS) -> List[Dict[str, Any]]:
     """
     Truncate conversation messages to fit within token limit.
     Simply keeps the most recent messages that fit within the token budget.
     Ensures the last message is not from the assistant.
 
     Args:
-        messages: List of conversation messages
+        history: Conversation history with cached token counts
         max_tokens: Maximum allowed tokens
 
     Returns:
         Truncated list of messages that fit within the token budget
     """
-    if not messages:
-        return []
+    end = len(history)
 
-    truncated = messages.copy()
-    
     # Remove last message if it's from assistant
-    if truncated and truncated[-1]["role"] == "assistant":
-        truncated = truncated[:-1]
-
-    total_tokens = 0
+    if end and history.messages[end - 1]["role"] == "assistant":
+        end -= 1
 
-    # Work backwards from the end to keep most recent messages
-    for i in range(len(truncated) - 1, -1, -1):
-        message_tokens = tokeniser.estimate_tokens(truncated[i]["content"])
-        total_tokens += message_tokens
-        
-        if total_tokens > max_tokens:
-            truncated = truncated[i + 1:]
-            break
+    # Keep the longest suffix of messages[:end] whose tokens fit the budget:
+    # the smallest start with prefix[end] - prefix[start] <= max_tokens
+    prefix = history.prefix_tokens
+    start = bisect.bisect_left(prefix, prefix[end] - max_tokens, 0, end + 1)
+    truncated = history.messages[start:end]
 
     # Double check: remove last message if it's from assistant after truncation
     if truncated and truncated[-1]["role"] == "assistant":
@@ -86,10 +206,19 @@ def truncate_messages(messages: List[Dict[str, Any]], max_tokens: int = MAX_CONT
     return truncated
 
 
+def normalize_query(query: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation so near-identical queries share a cache entry"""
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+
 async def search_web(query: str, depth: str) -> str:
     """
     Search the web using Linkup SDK
 
+    Results are cached for SEARCH_CACHE_TTL_SECONDS across all sessions. The
+    SDK's async client is used, so a search that times out is cancelled
+    rather than left running in a worker thread.
+
     Args:
         query: The search query string
         depth: Search depth ("standard" or "deep")
@@ -97,11 +226,22 @@ async def search_web(query: str, depth: str) -> str:
     Returns:
         Formatted search results as markdown text
     """
+    key = (normalize_query(query), depth)
+    cached = search_cache.get(key)
+    if cached and time.monotonic() - cached[0] < SEARCH_CACHE_TTL_SECONDS:
+        search_cache.move_to_end(key)
+        return cached[1]
+
     try:
-        search_results = linkup_client.search(
-            query=query,
-            depth=depth,
-            output_type="searchResults",
+        # The HTTP timeout applies per read; wait_for bounds the whole search
+        search_results = await asyncio.wait_for(
+            linkup_client.async_search(
+                query=query,
+                depth=depth,
+                output_type="searchResults",
+                timeout=SEARCH_TIMEOUT_SECONDS,
+            ),
+            timeout=SEARCH_TIMEOUT_SECONDS,
         )
 
         formatted_text = "Search results:\n\n"
@@ -111,15 +251,35 @@ async def search_web(query: str, depth: str) -> str:
             formatted_text += f"   URL: {result.url}\n"
             formatted_text += f"   {result.content}\n\n"
 
+        search_cache[key] = (time.monotonic(), formatted_text)
+        search_cache.move_to_end(key)
+        while len(search_cache) > SEARCH_CACHE_SIZE:
+            search_cache.popitem(last=False)
+
         return formatted_text
+    except (asyncio.TimeoutError, LinkupTimeoutError):
+        return f"Search failed: timed out after {SEARCH_TIMEOUT_SECONDS} seconds"
     except Exception as e:
         return f"Search failed: {str(e)}"
 
 
+async def run_tool_call(tool_info: Dict[str, Any]) -> str:
+    """Execute a single tool call and return its result for the conversation context"""
+    arguments = json.loads(tool_info["arguments"])
+
+    if tool_info["name"] == "search_web":
+        return await search_web(arguments["query"], arguments["depth"])
+
+    raise ValueError(f"Unknown tool {tool_info['name']}")
+
+
 async def process_tool_calls(tool_calls: Dict, context_messages: List[Dict[str, Any]], msg: cl.Message):
     """
     Process tool calls made by the model
 
+    All tool calls of a turn run concurrently; their results are added to the
+    context in the order the model requested them.
+
     Args:
         tool_calls: Dictionary of tool calls from the model
         context_messages: Conversation context
@@ -131,31 +291,25 @@ async def process_tool_calls(tool_calls: Dict, context_messages: List[Dict[str,
     # Show temporary "searching" message
     tmp_message = cl.Message(content="Searching the web...", author="Tool")
     await tmp_message.send()
-    await cl.sleep(1)
-
-    for _, tool_info in tool_calls.items():
-        try:
-            arguments = json.loads(tool_info["arguments"])
-
-            if tool_info["name"] == "search_web":
-                # Execute web search
-                search_result = await search_web(
-                    arguments["query"],
-                    arguments["depth"]
-                )
-
-                # Add search results to conversation context
-                context_messages.append({
-                    "role": "user",
-                    "content": search_result
-                })
-
-        except json.JSONDecodeError:
+
+    results = await asyncio.gather(
+        *(run_tool_call(tool_info) for _, tool_info in sorted(tool_calls.items())),
+        return_exceptions=True,
+    )
+
+    for result in results:
+        if isinstance(result, json.JSONDecodeError):
             await msg.stream_token("Error: Failed to parse tool arguments")
             return "Error: Failed to parse tool arguments"
-        except Exception as e:
-            await msg.stream_token(f"Error: Tool execution failed - {str(e)}")
-            return f"Error: Tool execution failed - {str(e)}"
+        if isinstance(result, Exception):
+            await msg.stream_token(f"Error: Tool execution failed - {str(result)}")
+            return f"Error: Tool execution failed - {str(result)}"
+
+        # Add tool results to conversation context
+        context_messages.append({
+            "role": "user",
+            "content": result
+        })
 
     # Remove temporary message
     await tmp_message.remove()
@@ -165,7 +319,7 @@ async def process_tool_calls(tool_calls: Dict, context_messages: List[Dict[str,
 
     await msg.stream_token("\n\n")
 
-    tool_response = ""
+    accumulator = StreamAccumulator()
     stream = await litellm.acompletion(
         model=DEFAULT_MODEL,
         messages=[
@@ -174,19 +328,19 @@ async def process_tool_calls(tool_calls: Dict, context_messages: List[Dict[str,
     )
 
     async for chunk in stream:
-        if chunk.choices[0].delta.content:
-            tool_response += chunk.choices[0].delta.content
-            await msg.stream_token(chunk.choices[0].delta.content)
+        text = accumulator.add(chunk)
+        if text:
+            await msg.stream_token(text)
             
-    return tool_response
+    return accumulator.text
 
 
-async def run_with_tools(messages: List[Dict[str, Any]], selected_tool: str = None) -> str:
+async def run_with_tools(messages: ChatHistory, selected_tool: str = None) -> str:
     """
     Run a conversation through Claude with function calling enabled.
 
     Args:
-        messages: List of conversation messages
+        messages: Conversation history
         selected_tool: Optional tool to force using
 
     Returns:
@@ -204,8 +358,7 @@ async def run_with_tools(messages: List[Dict[str, Any]], selected_tool: str = No
         tool_choice = {"type": "function", "function": {"name": selected_tool}}
 
     # Initial response generation
-    current_tool_calls = {}
-    response_content = ""
+    accumulator = StreamAccumulator()
 
     system_prompt = "You're an helpful assistant. Please provide a response to the user's query."
 
@@ -221,29 +374,12 @@ async def run_with_tools(messages: List[Dict[str, Any]], selected_tool: str = No
         )
 
         async for chunk in stream:
-            # Process text content
-            if chunk.choices[0].delta.content:
-                response_content += chunk.choices[0].delta.content
-                await msg.stream_token(chunk.choices[0].delta.content)
-
-            # Process tool calls
-            if chunk.choices[0].delta.tool_calls:
-                for tool_call in chunk.choices[0].delta.tool_calls:
-                    tool_id = tool_call.index
-
-                    # Initialize new tool call
-                    if tool_id not in current_tool_calls and tool_call.function.name:
-                        current_tool_calls[tool_id] = {
-                            "name": tool_call.function.name,
-                            "arguments": tool_call.function.arguments or ""
-                        }
-                    # Append to existing tool call
-                    elif tool_id in current_tool_calls:
-                        current_tool_calls[tool_id]["arguments"] += tool_call.function.arguments or ""
-
-            # Add assistant's response to context
-            context_messages.append(
-                {"role": "assistant", "content": response_content})
+            text = accumulator.add(chunk)
+            if text:
+                await msg.stream_token(text)
+
+        response_content = accumulator.text
+        current_tool_calls = accumulator.tool_calls
 
         # Send initial message
         await msg.send()
@@ -257,6 +393,10 @@ async def run_with_tools(messages: List[Dict[str, Any]], selected_tool: str = No
 
                 await msg.stream_token(response_content)
                 await msg.update()
+
+            # Add assistant's response to context, once for the whole stream
+            context_messages.append(
+                {"role": "assistant", "content": response_content})
                 
             tool_response = await process_tool_calls(current_tool_calls, context_messages, msg)
             
@@ -280,14 +420,14 @@ async def start_chat():
 
     await cl.context.emitter.set_commands(COMMANDS)
 
-    cl.user_session.set("chat_messages", [])
+    cl.user_session.set("chat_messages", ChatHistory())
 
 
 @cl.on_message
 async def on_message(msg: cl.Message):
     """Handle incoming user messages"""
 
-    chat_messages = cl.user_session.get("chat_messages", [])
+    chat_messages = cl.user_session.get("chat_messages") or ChatHistory()
     chat_messages.append({"role": "user", "content": msg.content})
 
     # Process message with or without explicit search command
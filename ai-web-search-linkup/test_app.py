@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+for module in ("chainlit", "tokeniser", "litellm", "linkup"):
+    pytest.importorskip(module)
+os.environ.setdefault("LINKUP_API_KEY", "test")
+
+from app import StreamAccumulator  # noqa: E402
+
+
+def _chat_chunk(content=None, tool_calls=None):
+    return {"choices": [{"delta": {"content": content, "tool_calls": tool_calls}}]}
+
+
+def _tool_fragment(index, arguments, call_id=None, name=None):
+    return {"index": index, "id": call_id, "function": {"name": name, "arguments": arguments}}
+
+
+def test_chat_chunks_build_one_turn():
+    acc = StreamAccumulator()
+    added = [acc.add(_chat_chunk(text)) for text in ("Hel", "lo", None, " world")]
+    assert added == ["Hel", "lo", "", " world"]
+    assert acc.text == "Hello world"
+    assert acc.tool_calls == {}
+
+
+def test_chat_tool_call_fragments_are_joined_per_index():
+    acc = StreamAccumulator()
+    acc.add(_chat_chunk(tool_calls=[_tool_fragment(0, "", "call_a", "search_web")]))
+    acc.add(_chat_chunk(tool_calls=[_tool_fragment(1, '{"query"', "call_b", "search_web")]))
+    acc.add(_chat_chunk(tool_calls=[_tool_fragment(0, '{"query": "a",')]))
+    acc.add(_chat_chunk(tool_calls=[_tool_fragment(1, ': "b", "depth": "deep"}')]))
+    acc.add(_chat_chunk(tool_calls=[_tool_fragment(0, ' "depth": "standard"}')]))
+    assert acc.tool_calls == {
+        0: {"id": "call_a", "name": "search_web", "arguments": '{"query": "a", "depth": "standard"}'},
+        1: {"id": "call_b", "name": "search_web", "arguments": '{"query": "b", "depth": "deep"}'},
+    }
+
+
+def test_fragments_before_the_call_is_named_are_ignored():
+    acc = StreamAccumulator()
+    acc.add(_chat_chunk(tool_calls=[_tool_fragment(0, '{"stray"')]))
+    assert acc.tool_calls == {}
+
+
+def test_anthropic_events():
+    acc = StreamAccumulator()
+    events = [
+        {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}},
+        {"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": "Searching"}},
+        {"type": "content_block_start", "index": 1,
+         "content_block": {"type": "tool_use", "id": "toolu_1", "name": "search_web"}},
+        {"type": "content_block_delta", "index": 1,
+         "delta": {"type": "input_json_delta", "partial_json": '{"query": "x", '}},
+        {"type": "content_block_delta", "index": 1,
+         "delta": {"type": "input_json_delta", "partial_json": '"depth": "standard"}'}},
+        {"type": "message_stop"},
+    ]
+    assert [acc.add(event) for event in events] == ["", "Searching", "", "", "", ""]
+    assert acc.text == "Searching"
+    assert acc.tool_calls == {
+        1: {"id": "toolu_1", "name": "search_web", "arguments": '{"query": "x", "depth": "standard"}'},
+    }
+
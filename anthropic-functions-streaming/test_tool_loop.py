@@ -0,0 +1,74 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("chainlit")
+
+from tool_loop import (  # noqa: E402
+    TOOL_ROUNDS_EXCEEDED,
+    ToolLoopStats,
+    final_text,
+    run_tool_loop,
+    run_tool_uses,
+)
+
+
+def _tool_use(call_id, name="get_weather"):
+    return SimpleNamespace(type="tool_use", id=call_id, name=name, input={})
+
+
+def _text(text):
+    return SimpleNamespace(type="text", text=text)
+
+
+def _response(*content, stop_reason="end_turn"):
+    return SimpleNamespace(content=list(content), stop_reason=stop_reason)
+
+
+async def _call_tool(tool_use):
+    if tool_use.name == "slow":
+        await asyncio.sleep(1)
+    if tool_use.name == "broken":
+        raise ValueError("bad input")
+    # Finish in reverse order to check results keep the request order
+    await asyncio.sleep(0.01 * (3 - int(tool_use.id[-1])))
+    return tool_use.id
+
+
+def test_results_keep_the_order_of_the_tool_uses():
+    results = asyncio.run(run_tool_uses([_tool_use(f"call_{i}") for i in range(3)], _call_tool))
+    assert [(r["tool_use_id"], r["content"]) for r in results] == [
+        ("call_0", "call_0"), ("call_1", "call_1"), ("call_2", "call_2")
+    ]
+    assert not any("is_error" in r for r in results)
+
+
+def test_timeouts_and_failures_become_error_results():
+    stats = ToolLoopStats()
+    tool_uses = [_tool_use("call_0", "slow"), _tool_use("call_1", "broken"), _tool_use("call_2")]
+    results = asyncio.run(run_tool_uses(tool_uses, _call_tool, timeouts={"slow": 0.05}, stats=stats))
+    assert [r.get("is_error", False) for r in results] == [True, True, False]
+    assert json.loads(results[0]["content"]) == {"error": "slow timed out after 0.05s"}
+    assert json.loads(results[1]["content"]) == {"error": "broken failed: bad input"}
+    assert (stats.timeouts, stats.tool_calls, stats.max_parallel_tools) == (1, 3, 3)
+
+
+def test_loop_stops_at_max_rounds():
+    messages = [{"role": "user", "content": "weather?"}]
+
+    async def call_claude(chat_messages):
+        return _response(_text("Checking"), _tool_use("call_0"), stop_reason="tool_use")
+
+    response, stats = asyncio.run(run_tool_loop(messages, call_claude, _call_tool, max_rounds=2))
+    assert (stats.model_round_trips, stats.tool_calls, stats.capped) == (3, 2, True)
+    # Every assistant tool_use turn in the history has its tool_result
+    assert [m["role"] for m in messages] == ["user", "assistant", "user", "assistant", "user"]
+    assert final_text(response) == f"Checking\n\n{TOOL_ROUNDS_EXCEEDED}"
+
+
+def test_final_text_is_never_empty():
+    assert final_text(_response(_text("Sunny"), _text(" today"))) == "Sunny today"
+    assert final_text(_response()) == "(no answer)"
+    assert final_text(_response(_tool_use("call_0"), stop_reason="tool_use")) == TOOL_ROUNDS_EXCEEDED
@@ -0,0 +1,130 @@
+"""
+Claude tool-use loop that runs every tool call of a turn at once
+
+When Claude answers with several `tool_use` blocks they are independent,
+so all of them are executed concurrently (each with its own timeout) and
+all the `tool_result` blocks go back in a single user message. That is one
+model round trip per turn of tool calls instead of one per tool call.
+Each turn's stats (model round trips, tool calls, timings) are logged.
+"""
+
+import asyncio
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from chainlit.logger import logger
+
+TOOL_TIMEOUT_S = float(os.getenv("TOOL_TIMEOUT_S", "60"))  # per tool call
+MAX_TOOL_ROUNDS = int(os.getenv("MAX_TOOL_ROUNDS", "10"))  # tool turns before giving up on a message
+TOOL_ROUNDS_EXCEEDED = "I stopped after too many rounds of tool calls. Please rephrase or narrow down the request."
+
+
+@dataclass
+class ToolLoopStats:
+    model_round_trips: int = 0
+    tool_calls: int = 0
+    max_parallel_tools: int = 0
+    timeouts: int = 0
+    capped: bool = False  # stopped at max_rounds while Claude still wanted tools
+    tool_seconds: float = 0.0  # wall time spent waiting on tools
+    total_seconds: float = 0.0
+
+    def __str__(self):
+        return (
+            f"model_round_trips={self.model_round_trips} tool_calls={self.tool_calls} "
+            f"max_parallel_tools={self.max_parallel_tools} timeouts={self.timeouts} capped={self.capped} "
+            f"tool_time={self.tool_seconds:.2f}s total_time={self.total_seconds:.2f}s"
+        )
+
+
+async def _run_one(
+    tool_use, call_tool: Callable[[Any], Awaitable[Any]], timeout: float, stats: ToolLoopStats
+) -> Dict[str, Any]:
+    result = {"type": "tool_result", "tool_use_id": tool_use.id}
+    try:
+        result["content"] = str(await asyncio.wait_for(call_tool(tool_use), timeout))
+    except asyncio.TimeoutError:
+        stats.timeouts += 1
+        result["content"] = json.dumps(
+            {"error": f"{tool_use.name} timed out after {timeout:g}s"}
+        )
+        result["is_error"] = True
+    except Exception as e:
+        result["content"] = json.dumps({"error": f"{tool_use.name} failed: {e}"})
+        result["is_error"] = True
+    return result
+
+
+async def run_tool_uses(
+    tool_uses: List[Any],
+    call_tool: Callable[[Any], Awaitable[Any]],
+    timeouts: Optional[Dict[str, float]] = None,
+    stats: Optional[ToolLoopStats] = None,
+) -> List[Dict[str, Any]]:
+    """Run the tool calls concurrently and return their tool_result blocks in order"""
+    stats = stats or ToolLoopStats()
+    timeouts = timeouts or {}
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            _run_one(tool_use, call_tool, timeouts.get(tool_use.name, TOOL_TIMEOUT_S), stats)
+            for tool_use in tool_uses
+        )
+    )
+    stats.tool_calls += len(tool_uses)
+    stats.max_parallel_tools = max(stats.max_parallel_tools, len(tool_uses))
+    stats.tool_seconds += time.perf_counter() - started
+    return list(results)
+
+
+async def run_tool_loop(
+    chat_messages: List[Dict[str, Any]],
+    call_claude: Callable[[List[Dict[str, Any]]], Awaitable[Any]],
+    call_tool: Callable[[Any], Awaitable[Any]],
+    timeouts: Optional[Dict[str, float]] = None,
+    max_rounds: int = MAX_TOOL_ROUNDS,
+):
+    """
+    Call Claude, run the tools it asks for and call it again until it stops
+    asking. The assistant and tool_result messages are appended to
+    `chat_messages`; returns the final response and the turn's stats.
+    """
+    stats = ToolLoopStats()
+    started = time.perf_counter()
+
+    response = await call_claude(chat_messages)
+    stats.model_round_trips += 1
+    rounds = 0
+    while response.stop_reason == "tool_use" and rounds < max_rounds:
+        rounds += 1
+        tool_uses = [block for block in response.content if block.type == "tool_use"]
+        tool_results = await run_tool_uses(tool_uses, call_tool, timeouts, stats)
+
+        chat_messages.extend(
+            [
+                {"role": "assistant", "content": response.content},
+                {"role": "user", "content": tool_results},
+            ]
+        )
+        response = await call_claude(chat_messages)
+        stats.model_round_trips += 1
+
+    stats.capped = response.stop_reason == "tool_use"
+    stats.total_seconds = time.perf_counter() - started
+    logger.info(f"Tool loop turn: {stats}")
+    return response, stats
+
+
+def final_text(response) -> str:
+    """
+    The assistant turn to keep in the history. Never empty: the API rejects
+    empty assistant content, which would break the next message.
+    """
+    text = "".join(block.text for block in response.content if block.type == "text")
+    if response.stop_reason == "tool_use":
+        # Capped: the pending tool calls were never answered, keep only the text
+        text = f"{text}\n\n{TOOL_ROUNDS_EXCEEDED}" if text else TOOL_ROUNDS_EXCEEDED
+    return text or "(no answer)"
@@ -0,0 +1,201 @@
+"""
+Offline ingestion of the PDFs in ./pdfs into the Pinecone index
+
+    python ingest.py [--path ./pdfs] [--embed-batch-size 256] [--upsert-batch-size 100] [--concurrency 4]
+
+Chunks are embedded with `embed_documents` in batches and upserted in bulk
+from a few worker threads sharing one index client. Chunk ids are content
+hashes and a local manifest (manifest.py) remembers what was ingested, so
+only new or changed PDFs are parsed, only chunks not stored yet are
+embedded, and chunks of deleted or edited PDFs are removed. Chunk ids the
+manifest doesn't know are looked up in the index before embedding, so a
+fresh container (empty manifest) re-parses the PDFs but doesn't pay to
+embed them again. Use --reset
+once to clear vectors written by older versions with random ids.
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Iterable, List, Optional, Set
+
+from dotenv import load_dotenv
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import (
+    PyMuPDFLoader,
+)
+from langchain_openai import AzureOpenAIEmbeddings
+from pinecone import Pinecone, ServerlessSpec
+
+from manifest import PdfManifest, chunk_id
+
+PDF_STORAGE_PATH = "./pdfs"
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "256"))  # chunks per embeddings request
+UPSERT_BATCH_SIZE = int(os.getenv("UPSERT_BATCH_SIZE", "100"))  # vectors per upsert request
+DELETE_BATCH_SIZE = 1000  # Pinecone's limit on ids per delete request
+FETCH_BATCH_SIZE = 100  # ids per fetch request (they go in the query string)
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))  # batches in flight
+
+# Load environment variables
+load_dotenv()
+
+# OpenAI configuration
+AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
+AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
+AZURE_OPENAI_ADA_DEPLOYMENT_VERSION = os.getenv("AZURE_OPENAI_ADA_DEPLOYMENT_VERSION")
+AZURE_OPENAI_ADA_EMBEDDING_DEPLOYMENT_NAME = os.getenv(
+    "AZURE_OPENAI_ADA_EMBEDDING_DEPLOYMENT_NAME"
+)
+AZURE_OPENAI_ADA_EMBEDDING_MODEL_NAME = os.getenv(
+    "AZURE_OPENAI_ADA_EMBEDDING_MODEL_NAME"
+)
+
+# Pinecone configuration
+PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+index_name = "primer"
+
+# Initialize Azure OpenAI embeddings
+embeddings = AzureOpenAIEmbeddings(
+    deployment=AZURE_OPENAI_ADA_EMBEDDING_DEPLOYMENT_NAME,
+    model=AZURE_OPENAI_ADA_EMBEDDING_MODEL_NAME,
+    azure_endpoint=AZURE_OPENAI_ENDPOINT,
+    openai_api_key=AZURE_OPENAI_API_KEY,
+    openai_api_version=AZURE_OPENAI_ADA_DEPLOYMENT_VERSION,
+)
+
+
+def get_index(pool_threads: int = INGEST_CONCURRENCY):
+    """Create the index if needed and return one client handle for all upserts"""
+    pc = Pinecone(api_key=PINECONE_API_KEY)
+    if index_name not in pc.list_indexes().names():
+        pc.create_index(
+            name=index_name,
+            dimension=1536,
+            metric="cosine",
+            spec=ServerlessSpec(cloud="aws", region="us-west-2"),
+        )
+    return pc.Index(index_name, pool_threads=pool_threads)
+
+
+def load_pdfs(pdf_paths: Iterable[Path]) -> List[Document]:
+    docs = []
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+
+    # Load PDFs and split into documents
+    for pdf_path in pdf_paths:
+        loader = PyMuPDFLoader(str(pdf_path))
+        documents = loader.load()
+        docs += text_splitter.split_documents(documents)
+    return docs
+
+
+def stored_ids(index, ids: List[str], batch_size: int = FETCH_BATCH_SIZE) -> Set[str]:
+    """The subset of `ids` the index already holds"""
+    found = set()
+    for start in range(0, len(ids), batch_size):
+        found.update(index.fetch(ids=ids[start:start + batch_size]).vectors)
+    return found
+
+
+def process_pdfs(
+    pdf_storage_path: str,
+    index,
+    embeddings=embeddings,
+    embed_batch_size: int = EMBED_BATCH_SIZE,
+    upsert_batch_size: int = UPSERT_BATCH_SIZE,
+    concurrency: int = INGEST_CONCURRENCY,
+    manifest: Optional[PdfManifest] = None,
+) -> int:
+    """Bring the index in line with the PDFs on disk, returning the number of vectors stored"""
+    manifest = manifest or PdfManifest()
+    diff = manifest.diff(sorted(Path(pdf_storage_path).glob("*.pdf")))
+    print(f"PDFs: {len(diff.changed)} new or changed, {len(diff.unchanged)} unchanged, "
+          f"{len(diff.deleted)} deleted.")
+
+    old_ids = {}
+    new_ids = {}
+    for pdf_path in diff.changed:
+        entry = manifest.get(str(pdf_path))
+        old_ids[str(pdf_path)] = set(entry.chunk_ids) if entry else set()
+        new_ids[str(pdf_path)] = set()
+
+    # Only chunks that aren't in the index yet need embedding
+    pending = {}
+    for doc in load_pdfs(diff.changed):
+        source = doc.metadata["source"]
+        cid = chunk_id(doc)
+        new_ids[source].add(cid)
+        if cid not in old_ids[source]:
+            pending[cid] = doc
+    # The manifest may be missing or stale (e.g. a new container); the index is the source of truth
+    already_stored = stored_ids(index, list(pending))
+    if already_stored:
+        print(f"Skipping {len(already_stored)} chunks already in the Pinecone index.")
+    pending_items = [(cid, doc) for cid, doc in pending.items() if cid not in already_stored]
+
+    def embed_and_upsert(batch) -> int:
+        texts = [doc.page_content for _, doc in batch]
+        vectors = [
+            {
+                "id": cid,
+                "values": values,
+                "metadata": {"source": text},
+            }
+            for (cid, _), text, values in zip(batch, texts, embeddings.embed_documents(texts))
+        ]
+        for start in range(0, len(vectors), upsert_batch_size):
+            index.upsert(vectors=vectors[start:start + upsert_batch_size])
+        return len(vectors)
+
+    stored = 0
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+        futures = [
+            pool.submit(embed_and_upsert, pending_items[start:start + embed_batch_size])
+            for start in range(0, len(pending_items), embed_batch_size)
+        ]
+        for future in as_completed(futures):
+            stored += future.result()
+            print(f"Stored {stored}/{len(pending_items)} vectors in Pinecone index.")
+
+    # Everything is stored; now drop chunks that no longer exist
+    stale = [cid for source in old_ids for cid in old_ids[source] - new_ids[source]]
+    stale += [cid for entry in diff.deleted for cid in entry.chunk_ids]
+    for start in range(0, len(stale), DELETE_BATCH_SIZE):
+        index.delete(ids=stale[start:start + DELETE_BATCH_SIZE])
+    if stale:
+        print(f"Removed {len(stale)} stale vectors from Pinecone index.")
+
+    for pdf_path in diff.changed:
+        manifest.put(pdf_path, diff.hashes[str(pdf_path)], new_ids[str(pdf_path)])
+    for entry in diff.deleted:
+        manifest.remove(entry.path)
+    return stored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed the PDFs and store them in Pinecone")
+    parser.add_argument("--path", default=PDF_STORAGE_PATH)
+    parser.add_argument("--embed-batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--upsert-batch-size", type=int, default=UPSERT_BATCH_SIZE)
+    parser.add_argument("--concurrency", type=int, default=INGEST_CONCURRENCY)
+    parser.add_argument("--reset", action="store_true", help="Delete all vectors and re-ingest everything")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = get_index(args.concurrency)
+    manifest = PdfManifest()
+    if args.reset:
+        index.delete(delete_all=True)
+        manifest.clear()
+    count = process_pdfs(
+        args.path,
+        index,
+        embed_batch_size=args.embed_batch_size,
+        upsert_batch_size=args.upsert_batch_size,
+        concurrency=args.concurrency,
+        manifest=manifest,
+    )
+    print(f"Ingested {count} chunks in {time.perf_counter() - started:.1f}s")
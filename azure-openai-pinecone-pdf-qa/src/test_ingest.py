@@ -0,0 +1,127 @@
+import os
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+for module in ("dotenv", "langchain", "langchain_community", "langchain_openai", "pinecone"):
+    pytest.importorskip(module)
+os.environ.setdefault("AZURE_OPENAI_API_KEY", "test")
+os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "https://example.openai.azure.com")
+os.environ.setdefault("AZURE_OPENAI_ADA_DEPLOYMENT_VERSION", "2024-02-01")
+
+from langchain.schema import Document  # noqa: E402
+
+import ingest  # noqa: E402
+from manifest import PdfManifest, chunk_id  # noqa: E402
+
+
+class _Index:
+    """In-memory Pinecone index that records each request"""
+
+    def __init__(self):
+        self.vectors = {}
+        self.upserts = []
+        self.deletes = []
+        self._lock = threading.Lock()
+
+    def upsert(self, vectors):
+        with self._lock:
+            self.upserts.append(len(vectors))
+            self.vectors.update({v["id"]: v for v in vectors})
+
+    def delete(self, ids):
+        self.deletes.append(list(ids))
+        for cid in ids:
+            self.vectors.pop(cid, None)
+
+    def fetch(self, ids):
+        return SimpleNamespace(vectors={cid: self.vectors[cid] for cid in ids if cid in self.vectors})
+
+
+class _Embeddings:
+    def __init__(self):
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.batches.append(len(texts))
+        return [[float(len(text))] for text in texts]
+
+
+def _load_lines(pdf_paths):
+    # One chunk per line stands in for PyMuPDF and the text splitter
+    return [
+        Document(page_content=line, metadata={"source": str(path)})
+        for path in pdf_paths
+        for line in path.read_text().splitlines()
+    ]
+
+
+@pytest.fixture
+def pdfs(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "load_pdfs", _load_lines)
+    folder = tmp_path / "pdfs"
+    folder.mkdir()
+    return folder
+
+
+def _ingest(pdfs, index, manifest, embeddings=None, **kwargs):
+    embeddings = embeddings or _Embeddings()
+    stored = ingest.process_pdfs(str(pdfs), index, embeddings=embeddings, manifest=manifest, **kwargs)
+    return stored, embeddings
+
+
+def test_chunk_id_depends_on_source_and_text():
+    doc = Document(page_content="hello", metadata={"source": "a.pdf", "page": 0})
+    assert chunk_id(doc) == chunk_id(Document(page_content="hello", metadata={"source": "a.pdf", "page": 3}))
+    assert chunk_id(doc) != chunk_id(Document(page_content="hello", metadata={"source": "b.pdf"}))
+    assert chunk_id(doc) != chunk_id(Document(page_content="hello!", metadata={"source": "a.pdf"}))
+
+
+def test_chunks_are_embedded_and_upserted_in_batches(pdfs, tmp_path):
+    (pdfs / "a.pdf").write_text("\n".join(f"line {i}" for i in range(25)))
+    index = _Index()
+    stored, embeddings = _ingest(
+        pdfs, index, PdfManifest(str(tmp_path / "m.sqlite")), embed_batch_size=10, upsert_batch_size=4
+    )
+    assert stored == len(index.vectors) == 25
+    assert sorted(embeddings.batches) == [5, 10, 10]
+    assert sorted(index.upserts) == [1, 2, 2, 4, 4, 4, 4, 4]
+
+
+def test_rerun_only_touches_what_changed(pdfs, tmp_path):
+    manifest = PdfManifest(str(tmp_path / "m.sqlite"))
+    (pdfs / "a.pdf").write_text("one\ntwo")
+    (pdfs / "b.pdf").write_text("three")
+    index = _Index()
+    _ingest(pdfs, index, manifest)
+
+    # Unchanged: nothing is embedded
+    stored, embeddings = _ingest(pdfs, index, manifest)
+    assert (stored, embeddings.batches) == (0, [])
+
+    # Touched but identical: still nothing
+    os.utime(pdfs / "a.pdf", ns=(1, 1))
+    assert _ingest(pdfs, index, manifest)[0] == 0
+
+    # Edited: only the new line is embedded, the removed one is deleted
+    (pdfs / "a.pdf").write_text("one\nTWO")
+    (pdfs / "b.pdf").unlink()
+    stored, _ = _ingest(pdfs, index, manifest)
+    assert stored == 1
+    assert sorted(v["metadata"]["source"] for v in index.vectors.values()) == ["TWO", "one"]
+    assert [entry.path for entry in manifest.entries()] == [str(pdfs / "a.pdf")]
+
+
+def test_empty_manifest_reuses_vectors_already_in_the_index(pdfs, tmp_path):
+    (pdfs / "a.pdf").write_text("one\ntwo")
+    index = _Index()
+    _ingest(pdfs, index, PdfManifest(str(tmp_path / "first.sqlite")))
+
+    # A fresh container: the manifest is gone but the index still has the chunks
+    (pdfs / "a.pdf").write_text("one\ntwo\nthree")
+    stored, embeddings = _ingest(pdfs, index, PdfManifest(str(tmp_path / "second.sqlite")))
+    assert (stored, embeddings.batches) == (1, [1])
+    assert len(index.vectors) == 3
@@ -1,12 +1,35 @@
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from datetime import date
+from typing import Dict, Optional, Tuple
 
+import pandas as pd
 from openai import AsyncOpenAI
 from google.cloud import bigquery
 
+try:
+    from google.cloud import bigquery_storage
+except ImportError:  # Results are paged over the REST API instead
+    bigquery_storage = None
+
 import chainlit as cl
 
 # Set up BigQuery client
 client = bigquery.Client(location="EU")
+bqstorage_client = bigquery_storage.BigQueryReadClient() if bigquery_storage else None
+
+QUERY_TIMEOUT_SECONDS = 120
+PROMPT_MAX_ROWS = 50  # Rows shown to the model; the rest are summarized
+QUERY_MAX_ROWS = 100_000  # Rows read at most for the summary
+QUERY_CACHE_TTL_SECONDS = 300
+QUERY_CACHE_SIZE = 64
+SUMMARY_MAX_DISTINCT = 20  # Columns with more distinct values only get min/max
+
+# Normalized SQL -> (time cached, result), shared by all sessions
+query_cache: "OrderedDict[str, Tuple[float, QueryResult]]" = OrderedDict()
 
 openai_client = AsyncOpenAI()
 
@@ -60,19 +83,121 @@ async def gen_query(human_query: str):
     return current_step.output
 
 
+@dataclass
+class ColumnSummary:
+    non_null: int = 0
+    minimum: object = None
+    maximum: object = None
+    counts: Optional[Dict[object, int]] = field(default_factory=dict)  # None once too many distinct values
+
+
+@dataclass
+class QueryResult:
+    """The first rows of a result plus a running summary of everything after them"""
+
+    head: pd.DataFrame
+    total_rows: int = 0  # size of the whole result, as reported by BigQuery
+    rows_read: int = 0  # rows actually read, at most QUERY_MAX_ROWS
+    truncated: bool = False
+    columns: Dict[str, ColumnSummary] = field(default_factory=dict)
+
+    def add_remainder(self, df: pd.DataFrame):
+        """Fold rows beyond the head into per-column statistics"""
+        for name in df.columns:
+            values = df[name].dropna()
+            summary = self.columns.setdefault(name, ColumnSummary())
+            summary.non_null += len(values)
+            if values.empty:
+                continue
+            try:
+                low, high = values.min(), values.max()
+                summary.minimum = low if summary.minimum is None else min(summary.minimum, low)
+                summary.maximum = high if summary.maximum is None else max(summary.maximum, high)
+            except TypeError:
+                pass
+            if summary.counts is not None:
+                try:
+                    for value, count in values.value_counts().items():
+                        summary.counts[value] = summary.counts.get(value, 0) + int(count)
+                except TypeError:  # unhashable values (arrays, structs)
+                    summary.counts = None
+                if summary.counts is not None and len(summary.counts) > SUMMARY_MAX_DISTINCT:
+                    summary.counts = None
+
+    def to_markdown(self) -> str:
+        table = self.head.to_markdown(index=False)
+        remaining = self.total_rows - len(self.head)
+        if remaining <= 0:
+            return table
+        if self.truncated:
+            summarized = f"read limit reached, so only the next {self.rows_read - len(self.head)} are summarized per column"
+        else:
+            summarized = "summarized per column"
+        lines = [table, "", f"... {remaining} more rows; {summarized}:"]
+        for name, summary in self.columns.items():
+            parts = [f"{summary.non_null} non-null"]
+            if summary.minimum is not None:
+                parts.append(f"min {summary.minimum}, max {summary.maximum}")
+            if summary.counts:
+                top = sorted(summary.counts.items(), key=lambda item: -item[1])
+                parts.append("values " + ", ".join(f"{value}: {count}" for value, count in top))
+            lines.append(f"- {name}: " + "; ".join(parts))
+        return "\n".join(lines)
+
+
+_STRING_LITERAL = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)""")
+
+
+def normalize_sql(query: str) -> str:
+    """Collapse whitespace outside string literals and identifiers, and drop trailing semicolons"""
+    parts = _STRING_LITERAL.split(query.strip().rstrip(";").strip())
+    return "".join(part if i % 2 else re.sub(r"\s+", " ", part) for i, part in enumerate(parts))
+
+
+def run_query(query: str) -> QueryResult:
+    """Blocking: run `query` and read its rows page by page (via the Storage Read API when available)"""
+    query_job = client.query(query)
+    rows = query_job.result(timeout=QUERY_TIMEOUT_SECONDS)
+
+    result = None
+    for page in rows.to_dataframe_iterable(bqstorage_client=bqstorage_client):
+        if result is None:
+            result = QueryResult(head=page.iloc[:0])
+        result.rows_read += len(page)
+        take = PROMPT_MAX_ROWS - len(result.head)
+        if take > 0:
+            result.head = pd.concat([result.head, page.iloc[:take]], ignore_index=True)
+            page = page.iloc[take:]
+        if len(page):
+            result.add_remainder(page)
+        if result.rows_read >= QUERY_MAX_ROWS:
+            result.truncated = True
+            break
+
+    if result is None:
+        result = QueryResult(head=pd.DataFrame(columns=[f.name for f in rows.schema]))
+    # The iterator knows the full result size even when we stop reading early
+    result.total_rows = rows.total_rows if rows.total_rows is not None else result.rows_read
+    return result
+
+
 @cl.step(type="tool")
 async def execute_query(query):
-    # Execute the SQL query
-    query_job = client.query(query)
+    key = normalize_sql(query)
+    cached = query_cache.get(key)
+    if cached and time.monotonic() - cached[0] < QUERY_CACHE_TTL_SECONDS:
+        query_cache.move_to_end(key)
+        return cached[1].to_markdown()
 
-    # Wait for the query to complete
-    query_job.result()
+    # The client is blocking; run it in a worker thread so other sessions keep going
+    result = await asyncio.to_thread(run_query, query)
 
-    # Get the query results
-    results = query_job.to_dataframe()
-    markdown_table = results.to_markdown(index=False)
+    query_cache[key] = (time.monotonic(), result)
+    query_cache.move_to_end(key)
+    while len(query_cache) > QUERY_CACHE_SIZE:
+        query_cache.popitem(last=False)
 
-    return markdown_table
+    return result.to_markdown()
 
 
 @cl.step(type="tool")
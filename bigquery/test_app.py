@@ -0,0 +1,95 @@
+import asyncio
+import os
+from types import SimpleNamespace
+from unittest import mock
+
+import pytest
+
+for module in ("chainlit", "openai", "pandas", "tabulate", "google.cloud.bigquery"):
+    pytest.importorskip(module)
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import pandas as pd  # noqa: E402
+
+# The BigQuery client is created at import; keep it off the network
+with mock.patch("google.cloud.bigquery.Client"):
+    import app  # noqa: E402
+
+
+class _Rows:
+    """Stand-in for a RowIterator: the full result size plus its pages"""
+
+    def __init__(self, df, page_size=40):
+        self.total_rows = len(df)
+        self.schema = [SimpleNamespace(name=name) for name in df.columns]
+        self._pages = [df.iloc[i:i + page_size] for i in range(0, len(df), page_size)]
+        self.pages_read = 0
+
+    def to_dataframe_iterable(self, bqstorage_client=None):
+        for page in self._pages:
+            self.pages_read += 1
+            yield page
+
+
+def _orders(n):
+    return pd.DataFrame({
+        "order_id": range(n),
+        "status": [["shipped", "late", "lost"][i % 3] for i in range(n)],
+    })
+
+
+def _run(rows):
+    query_job = mock.Mock()
+    query_job.result.return_value = rows
+    with mock.patch.object(app.client, "query", return_value=query_job):
+        return app.run_query("SELECT 1")
+
+
+def test_normalize_sql_collapses_whitespace_outside_literals():
+    query = "SELECT  *\n  FROM `demo.order`\tWHERE status = 'on   hold'  ;\n"
+    assert app.normalize_sql(query) == "SELECT * FROM `demo.order` WHERE status = 'on   hold'"
+    assert app.normalize_sql("select 'a''b' ,  \"x  y\"") == "select 'a''b' , \"x  y\""
+
+
+def test_small_result_is_shown_in_full():
+    result = _run(_Rows(_orders(10)))
+    assert result.total_rows == result.rows_read == 10
+    assert "more rows" not in result.to_markdown()
+
+
+def test_rows_beyond_the_head_are_summarized(monkeypatch):
+    monkeypatch.setattr(app, "PROMPT_MAX_ROWS", 5)
+    result = _run(_Rows(_orders(100)))
+    assert len(result.head) == 5
+    assert result.columns["order_id"].minimum == 5
+    assert result.columns["order_id"].maximum == 99
+    assert "... 95 more rows; summarized per column:" in result.to_markdown()
+
+
+def test_read_cap_reports_the_full_result_size(monkeypatch):
+    monkeypatch.setattr(app, "PROMPT_MAX_ROWS", 5)
+    monkeypatch.setattr(app, "QUERY_MAX_ROWS", 80)
+    rows = _Rows(_orders(1000))
+    result = _run(rows)
+    assert rows.pages_read == 2
+    assert (result.total_rows, result.rows_read, result.truncated) == (1000, 80, True)
+    assert "... 995 more rows; read limit reached, so only the next 75" in result.to_markdown()
+
+
+def test_query_cache_is_shared_until_the_ttl_expires(monkeypatch):
+    execute_query = getattr(app.execute_query, "__wrapped__", app.execute_query)
+    now = [1000.0]
+    monkeypatch.setattr(app.time, "monotonic", lambda: now[0])
+    app.query_cache.clear()
+    query_job = mock.Mock()
+    query_job.result.side_effect = lambda timeout=None: _Rows(_orders(3))
+
+    with mock.patch.object(app.client, "query", return_value=query_job) as query:
+        first = asyncio.run(execute_query("SELECT *  FROM t"))
+        # Same query modulo whitespace: served from the cache
+        assert asyncio.run(execute_query("SELECT * FROM t;")) == first
+        assert query.call_count == 1
+
+        now[0] += app.QUERY_CACHE_TTL_SECONDS + 1
+        asyncio.run(execute_query("SELECT * FROM t"))
+        assert query.call_count == 2
@@ -1,12 +1,10 @@
+import os
+import time
 from typing import List
 from pathlib import Path
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain.prompts import ChatPromptTemplate
 from langchain.schema import StrOutputParser
-from langchain_community.document_loaders import (
-    PyMuPDFLoader,
-)
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores.chroma import Chroma
 from langchain.indexes import SQLRecordManager, index
 from langchain.schema import Document
@@ -15,6 +13,9 @@ from langchain.callbacks.base import BaseCallbackHandler
 
 import chainlit as cl
 
+from manifest import PdfManifest
+from pdf_parser import parse_pdfs
+
 
 chunk_size = 1024
 chunk_overlap = 50
@@ -22,25 +23,50 @@ chunk_overlap = 50
 embeddings_model = OpenAIEmbeddings()
 
 PDF_STORAGE_PATH = "./pdfs"
+CHROMA_PERSIST_DIRECTORY = "./chroma_db"
+INDEX_BATCH_SIZE = int(os.getenv("INDEX_BATCH_SIZE", "256"))  # chunks per embeddings request
 
 
 def process_pdfs(pdf_storage_path: str):
-    pdf_directory = Path(pdf_storage_path)
-    docs = []  # type: List[Document]
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-
-    for pdf_path in pdf_directory.glob("*.pdf"):
-        loader = PyMuPDFLoader(str(pdf_path))
-        documents = loader.load()
-        docs += text_splitter.split_documents(documents)
+    """
+    Sync the persistent Chroma collection with the PDFs on disk
 
-    doc_search = Chroma.from_documents(docs, embeddings_model)
+    The manifest skips unchanged PDFs without parsing them and changed ones
+    are parsed in a process pool. `index` is the only write path: the record
+    manager embeds just the chunks whose content hash isn't stored yet, in
+    batches of INDEX_BATCH_SIZE, and removes the outdated ones. Chunks of
+    deleted PDFs are purged.
+    """
+    started = time.perf_counter()
+    doc_search = Chroma(
+        collection_name="my_documents",
+        embedding_function=embeddings_model,
+        persist_directory=CHROMA_PERSIST_DIRECTORY,
+    )
 
     namespace = "chromadb/my_documents"
     record_manager = SQLRecordManager(
         namespace, db_url="sqlite:///record_manager_cache.sql"
     )
     record_manager.create_schema()
+    manifest = PdfManifest()
+
+    # The collection was wiped (or never persisted), so forget what went into it
+    if doc_search._collection.count() == 0:
+        record_manager.delete_keys(record_manager.list_keys())
+        manifest.clear()
+
+    pdf_directory = Path(pdf_storage_path)
+    diff = manifest.diff(sorted(pdf_directory.glob("*.pdf")))
+    docs = []  # type: List[Document]
+    pages = 0
+    parse_started = time.perf_counter()
+    for parsed in parse_pdfs(diff.changed):
+        docs += parsed.docs
+        pages += parsed.pages
+        print(f"Parsed {parsed.path.name}: {parsed.pages} pages, "
+              f"{len(parsed.docs)} chunks in {parsed.seconds:.2f}s")
+    parsed_at = time.perf_counter()
 
     index_result = index(
         docs,
@@ -48,9 +74,34 @@ def process_pdfs(pdf_storage_path: str):
         doc_search,
         cleanup="incremental",
         source_id_key="source",
+        batch_size=INDEX_BATCH_SIZE,
+    )
+    indexed_at = time.perf_counter()
+
+    for entry in diff.deleted:
+        keys = record_manager.list_keys(group_ids=[entry.path])
+        if keys:
+            doc_search.delete(keys)
+            record_manager.delete_keys(keys)
+        manifest.remove(entry.path)
+    for pdf_path in diff.changed:
+        manifest.put(
+            pdf_path,
+            diff.hashes[str(pdf_path)],
+            record_manager.list_keys(group_ids=[str(pdf_path)]),
+        )
+
+    parse_s = parsed_at - parse_started
+    index_s = indexed_at - parsed_at
+    print(
+        f"PDFs: {len(diff.changed)} new or changed, {len(diff.unchanged)} unchanged, "
+        f"{len(diff.deleted)} deleted\n"
+        f"Parsed {pages} pages into {len(docs)} chunks in {parse_s:.2f}s\n"
+        f"Indexed in {index_s:.2f}s "
+        f"({index_result['num_added'] / index_s if index_s else 0:.1f} chunks embedded/s): "
+        f"{index_result}\n"
+        f"Total {time.perf_counter() - started:.2f}s"
     )
-
-    print(f"Indexing stats: {index_result}")
 
     return doc_search
 
@@ -0,0 +1,105 @@
+"""
+Local record of which PDFs have been ingested, so restarts only touch what changed
+
+Each PDF is stored with its modification time, size, content hash and the
+ids of the chunks it produced. An unchanged file (same mtime and size, or
+same hash) is skipped without being parsed, a changed file is re-chunked,
+and chunks of deleted files can be purged from the vector store.
+
+The chunk ids here are the record manager's keys (its hashed document
+ids), so unlike the Pinecone example's manifest this one doesn't derive
+ids itself.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+
+MANIFEST_PATH = os.getenv("INGEST_MANIFEST_PATH", "./ingest_manifest.sqlite")
+
+
+@dataclass
+class ManifestEntry:
+    path: str
+    mtime_ns: int
+    size: int
+    sha256: str
+    chunk_ids: List[str]
+
+
+@dataclass
+class ManifestDiff:
+    changed: List[Path] = field(default_factory=list)  # new or modified, need parsing
+    unchanged: List[Path] = field(default_factory=list)
+    deleted: List[ManifestEntry] = field(default_factory=list)
+    hashes: Dict[str, str] = field(default_factory=dict)  # content hashes computed while diffing
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PdfManifest:
+    def __init__(self, path: str = MANIFEST_PATH):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime_ns INTEGER, "
+            "size INTEGER, sha256 TEXT, chunk_ids TEXT)"
+        )
+
+    def get(self, path: str) -> Optional[ManifestEntry]:
+        row = self.conn.execute(
+            "SELECT path, mtime_ns, size, sha256, chunk_ids FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        return ManifestEntry(*row[:4], json.loads(row[4])) if row else None
+
+    def entries(self) -> List[ManifestEntry]:
+        rows = self.conn.execute("SELECT path, mtime_ns, size, sha256, chunk_ids FROM files")
+        return [ManifestEntry(*row[:4], json.loads(row[4])) for row in rows]
+
+    def put(self, path: Path, sha256: str, chunk_ids: Iterable[str]):
+        st = path.stat()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                (str(path), st.st_mtime_ns, st.st_size, sha256, json.dumps(sorted(set(chunk_ids)))),
+            )
+
+    def remove(self, path: str):
+        with self.conn:
+            self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM files")
+
+    def diff(self, pdf_paths: Iterable[Path]) -> ManifestDiff:
+        """Sort the PDFs on disk into changed and unchanged, and find the deleted ones"""
+        result = ManifestDiff()
+        seen = set()
+        for pdf_path in pdf_paths:
+            seen.add(str(pdf_path))
+            entry = self.get(str(pdf_path))
+            st = pdf_path.stat()
+            if entry and (entry.mtime_ns, entry.size) == (st.st_mtime_ns, st.st_size):
+                result.unchanged.append(pdf_path)
+                continue
+            # Touched but identical files only need their signature refreshed
+            sha256 = file_sha256(pdf_path)
+            result.hashes[str(pdf_path)] = sha256
+            if entry and entry.sha256 == sha256:
+                self.put(pdf_path, sha256, entry.chunk_ids)
+                result.unchanged.append(pdf_path)
+            else:
+                result.changed.append(pdf_path)
+        result.deleted = [entry for entry in self.entries() if entry.path not in seen]
+        return result
@@ -0,0 +1,61 @@
+"""
+PDF parsing for process_pdfs, fanned out over worker processes
+
+PyMuPDF extraction and splitting are CPU-bound, so on a large corpus the
+PDFs are parsed in a process pool instead of one after another. The
+workers live in this module rather than app.py so that spawning them
+doesn't import the Chainlit app (and re-run the ingestion) in every child.
+"""
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Iterator, List, Sequence
+
+from langchain_community.document_loaders import (
+    PyMuPDFLoader,
+)
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+
+PARSER_PROCESSES = int(os.getenv("PARSER_PROCESSES", str(min(4, os.cpu_count() or 1))))
+
+
+@dataclass
+class ParsedPdf:
+    path: Path
+    docs: List[Document]
+    pages: int
+    seconds: float
+
+
+@lru_cache(maxsize=None)
+def get_text_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+
+
+def load_and_split(pdf_path: Path) -> ParsedPdf:
+    start = time.perf_counter()
+    documents = PyMuPDFLoader(str(pdf_path)).load()
+    docs = get_text_splitter().split_documents(documents)
+    return ParsedPdf(pdf_path, docs, len(documents), time.perf_counter() - start)
+
+
+def parse_pdfs(pdf_paths: Sequence[Path], processes: int = PARSER_PROCESSES) -> Iterator[ParsedPdf]:
+    """Parse and split the PDFs, yielding them in input order"""
+    if processes <= 1 or len(pdf_paths) <= 1:
+        for pdf_path in pdf_paths:
+            yield load_and_split(pdf_path)
+        return
+
+    # spawn rather than fork: Chainlit has already started threads
+    with ProcessPoolExecutor(
+        max_workers=min(processes, len(pdf_paths)),
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as pool:
+        yield from pool.map(load_and_split, pdf_paths)
@@ -1,3 +1,4 @@
+import asyncio
 from datetime import datetime, timezone
 from typing import Dict, Optional
 from uuid import uuid4
@@ -5,17 +6,19 @@ from uuid import uuid4
 from langchain_core.runnables import RunnableConfig
 from langchain.callbacks.base import BaseCallbackHandler
 from langchain_core.messages import HumanMessage, AIMessage
-from langchain_core.messages.utils import trim_messages, count_tokens_approximately
 from langchain_sandbox import PyodideSandboxTool
 
 from langgraph.prebuilt import create_react_agent
-from langgraph.checkpoint.memory import InMemorySaver, CheckpointMetadata, Checkpoint, ChannelVersions
+from langgraph.checkpoint.base import CheckpointMetadata, Checkpoint, ChannelVersions
+from langgraph.checkpoint.base.id import uuid6
 
-from services.document_loader import AsyncLoader
+from services.checkpointer import SqliteCheckpointSaver
+from services.ingestion import IngestFile, ingest_files
+from services.message_trimmer import MessageTrimmer
 from tools.rag_search import rag_search
 from tools.file_search import file_search
 
-from services.azure_services import AzureServices
+from services.azure_services import get_azure_services
 
 from chainlit.types import ThreadDict
 import chainlit as cl
@@ -37,7 +40,8 @@ mimetypes.add_type("image/tiff", ".tiff")
 mimetypes.add_type("image/heif", ".heif")
 mimetypes.add_type("text/html", ".html")
 
-checkpointer = InMemorySaver()
+# Conversation state is kept on disk, so it survives restarts and idle threads don't hold RAM
+checkpointer = SqliteCheckpointSaver()
 
 python_code_sandbox = PyodideSandboxTool(
     # Allow Pyodide to install python packages that
@@ -46,16 +50,18 @@ python_code_sandbox = PyodideSandboxTool(
 )
 
 
+# Same window as trim_messages(strategy="last", token_counter=count_tokens_approximately),
+# but token counts are cached per message and each call resumes from the last cut
+message_trimmer = MessageTrimmer(
+    max_tokens=10000,
+    start_on="human",
+    end_on=("human", "tool"),
+)
+
+
 # This function will be called every time before the node that calls LLM
 def pre_model_hook(state):
-    trimmed_messages = trim_messages(
-        state["messages"],
-        strategy="last",
-        token_counter=count_tokens_approximately,
-        max_tokens=10000,
-        start_on="human",
-        end_on=("human", "tool"),
-    )
+    trimmed_messages = message_trimmer.trim(state["messages"])
     # You can return updated messages either under `llm_input_messages` or
     # `messages` key (see the note below)
     return {"llm_input_messages": trimmed_messages}
@@ -85,7 +91,7 @@ class StreamHandler(BaseCallbackHandler):
         self.msg = cl.Message(content="")
 
 
-azure_services = AzureServices()
+azure_services = get_azure_services()
 
 
 # Function to setup the runnable environment for the chat application
@@ -169,20 +175,24 @@ async def file_loader(message: cl.Message):
     It uses the Azure AI Document Intelligence service to extract content from the files.
     """
 
-    documents = []
-    for element in message.elements:
-        loader = AsyncLoader()
+    files = [IngestFile(name=element.name, mime=element.mime, path=element.path)
+             for element in message.elements]
 
-        documents.extend(await loader.aload(
-            file_name=element.name,
-            file_mime=element.mime,
-            file_path=element.path
-        ))
+    # Parsing, embedding and uploading overlap; chunks are only uploaded when
+    # there is more than one of them (see below)
+    report = await ingest_files(
+        files,
+        thread_id=cl.user_session.get("current_thread"),
+        embeddings=azure_services.embeddings,
+        vector_store=azure_services.uploaded_files_vector_store,
+    )
+    documents = report.all_documents
 
     # If there is only a single document or chunk, directly insert that chunk into the chat history. The tool to search in uploaded files has a description that tells it to not use this tool if the information it needs is already present in the context. ChatGPT also uses this strategy.
     if len(documents) == 1:
 
         messages = [HumanMessage(
+            id=str(uuid4()),
             content=f"File uploaded: title={documents[0].metadata.get('title', None)}, page_content={documents[0].page_content}")]
 
         await write_checkpoint(cl.user_session.get("current_thread"), messages)
@@ -190,12 +200,12 @@ async def file_loader(message: cl.Message):
     # Otherwise, add only the title, and vectorize the documents
     else:
         messages = [HumanMessage(
+            id=str(uuid4()),
             content=(
                 f"File uploaded: title={documents[0].metadata.get('title', None)}"
             )
         )]
 
-        await azure_services.uploaded_files_vector_store.aadd_documents(documents=documents)
         await write_checkpoint(cl.user_session.get("current_thread"), messages)
 
     cl.user_session.set("uploaded_files", True)
@@ -207,6 +217,9 @@ async def file_loader(message: cl.Message):
         content="Done reading and memorizing files.",
     ).send()
 
+    # Shown as the step output, so slow uploads can be traced to a stage
+    return report.summary(files)
+
 
 @cl.on_chat_resume
 async def on_chat_resume(thread: ThreadDict):
@@ -215,13 +228,16 @@ async def on_chat_resume(thread: ThreadDict):
     It initializes the ConversationSummaryBufferMemory with the history from the previous session.
     """
 
-    messages = [
-        (HumanMessage if s["type"] == "USER_MESSAGE" else AIMessage)(
-            content=s["output"])
-        for s in thread["steps"]
-    ]
+    # The agent state is still on disk (including tool calls); it is loaded
+    # when the agent next runs. Only rebuild it from the steps if it is gone.
+    if not await asyncio.to_thread(checkpointer.has_thread, thread["id"]):
+        messages = [
+            (HumanMessage if s["type"] == "USER_MESSAGE" else AIMessage)(
+                id=str(uuid4()), content=s["output"])
+            for s in thread["steps"]
+        ]
 
-    await write_checkpoint(thread["id"], messages)
+        await write_checkpoint(thread["id"], messages)
     await setup_runnable()
 
 
@@ -260,7 +276,13 @@ async def write_checkpoint(
 
     Returns the generated checkpoint-id.
     """
-    checkpoint_id = str(uuid4())
+    # The trimmer caches token counts and its cut points by message id
+    for message in messages:
+        if not message.id:
+            message.id = str(uuid4())
+
+    # Time-ordered like LangGraph's own ids, so this is the latest checkpoint
+    checkpoint_id = str(uuid6())
 
     checkpoint = Checkpoint(
         {
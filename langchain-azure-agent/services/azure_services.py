@@ -1,4 +1,6 @@
+import json
 import os
+from functools import cached_property, lru_cache
 from azure.search.documents.indexes.models import (
     SearchableField,
     SearchField,
@@ -9,9 +11,22 @@ from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
 from langchain_community.vectorstores.azuresearch import AzureSearch
 
 
+EMBEDDINGS_MODEL = "text-embedding-3-large"
+
+# Small local file remembering the vector size of each embeddings deployment,
+# so startup doesn't need an embedding call just to size the index fields
+EMBEDDING_DIMENSION_CACHE = os.environ.get(
+    'EMBEDDING_DIMENSION_CACHE', os.path.join('.cache', 'embedding_dimensions.json'))
+
+
 class AzureServices:
     """
     Class to encapsulate Azure Search and OpenAI services configuration and functionality.
+
+    Clients are created lazily on first access and then reused. Use
+    `get_azure_services()` to share a single instance across the process;
+    it also resolves the embedding dimension up front, so no request ever
+    blocks the event loop on the probe.
     """
 
     def __init__(self):
@@ -30,8 +45,10 @@ class AzureServices:
         self.azure_openai_api_key = os.environ.get('AZURE_OPENAI_API_KEY')
         self.azure_openai_endpoint = os.environ.get('AZURE_OPENAI_ENDPOINT')
 
-        # Initialize the Azure Chat OpenAI model
-        self.model = AzureChatOpenAI(
+    @cached_property
+    def model(self):
+        """Azure Chat OpenAI model"""
+        return AzureChatOpenAI(
             azure_deployment=self.azure_openai_chat_deployment_name,
             openai_api_version=self.azure_openai_api_version,
             azure_endpoint=self.azure_openai_endpoint,
@@ -39,33 +56,68 @@ class AzureServices:
             streaming=True
         )
 
-        self.final_model = self.model.with_config(tags=["final_node"])
+    @cached_property
+    def final_model(self):
+        return self.model.with_config(tags=["final_node"])
 
-        # Initialize the Azure OpenAI Embeddings model
-        self.embeddings = AzureOpenAIEmbeddings(
+    @cached_property
+    def embeddings(self):
+        """Azure OpenAI Embeddings model"""
+        return AzureOpenAIEmbeddings(
             azure_deployment=self.azure_openai_embeddings_deployment_name,
             openai_api_version=self.azure_openai_api_version,
             azure_endpoint=self.azure_openai_endpoint,
             api_key=self.azure_openai_api_key,
-            model="text-embedding-3-large",
+            model=EMBEDDINGS_MODEL,
+        )
 
+    @cached_property
+    def embedding_dimension(self) -> int:
+        """Vector size of the embeddings deployment, embedding a probe text only on a cache miss"""
+        key = "{}|{}|{}".format(
+            self.azure_openai_endpoint,
+            self.azure_openai_embeddings_deployment_name,
+            EMBEDDINGS_MODEL)
+        try:
+            with open(EMBEDDING_DIMENSION_CACHE, encoding="utf-8") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+        if isinstance(cache.get(key), int):
+            return cache[key]
+
+        dimension = len(self.embeddings.embed_query("Text"))
+        cache[key] = dimension
+        try:
+            os.makedirs(os.path.dirname(EMBEDDING_DIMENSION_CACHE) or ".", exist_ok=True)
+            tmp_path = EMBEDDING_DIMENSION_CACHE + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f)
+            os.replace(tmp_path, EMBEDDING_DIMENSION_CACHE)
+        except OSError:
+            # Not fatal - we'll probe again on the next start
+            pass
+        return dimension
+
+    def _content_vector_field(self):
+        return SearchField(
+            name="content_vector",
+            type=SearchFieldDataType.Collection(
+                SearchFieldDataType.Single),
+            searchable=True,
+            vector_search_dimensions=self.embedding_dimension,
+            vector_search_profile_name="myHnswProfile",
         )
 
-        # Define fields for user-upload index
-        self.uploaded_files_fields = [
+    @cached_property
+    def uploaded_files_fields(self):
+        """Fields for user-upload index"""
+        return [
             SimpleField(name="id", type=SearchFieldDataType.String,
                         key=True, filterable=True),
             SearchableField(
                 name="content", type=SearchFieldDataType.String, searchable=True),
-            SearchField(
-                name="content_vector",
-                type=SearchFieldDataType.Collection(
-                    SearchFieldDataType.Single),
-                searchable=True,
-                vector_search_dimensions=len(
-                    self.embeddings.embed_query("Text")),
-                vector_search_profile_name="myHnswProfile",
-            ),
+            self._content_vector_field(),
             SearchableField(name="metadata",
                             type=SearchFieldDataType.String, searchable=True),
             SearchableField(
@@ -74,8 +126,10 @@ class AzureServices:
                         filterable=True, searchable=True)
         ]
 
-        # Initialize Azure Search vector store for user uploads
-        self.uploaded_files_vector_store = AzureSearch(
+    @cached_property
+    def uploaded_files_vector_store(self):
+        """Azure Search vector store for user uploads"""
+        return AzureSearch(
             azure_search_endpoint=self.azure_search_service_endpoint,
             azure_search_key=self.azure_search_api_key,
             index_name="uploaded-files-idx",
@@ -83,21 +137,15 @@ class AzureServices:
             fields=self.uploaded_files_fields,
         )
 
-        # Define fields for RAG index
-        self.rag_idx_fields = [
+    @cached_property
+    def rag_idx_fields(self):
+        """Fields for RAG index"""
+        return [
             SimpleField(name="id", type=SearchFieldDataType.String,
                         key=True, filterable=True),
             SearchableField(
                 name="content", type=SearchFieldDataType.String, searchable=True),
-            SearchField(
-                name="content_vector",
-                type=SearchFieldDataType.Collection(
-                    SearchFieldDataType.Single),
-                searchable=True,
-                vector_search_dimensions=len(
-                    self.embeddings.embed_query("Text")),
-                vector_search_profile_name="myHnswProfile",
-            ),
+            self._content_vector_field(),
             SearchableField(name="metadata",
                             type=SearchFieldDataType.String, searchable=True),
             SearchableField(
@@ -106,11 +154,23 @@ class AzureServices:
                         filterable=True)
         ]
 
-        # Initialize Azure Search vector store for RAG index
-        self.rag_vector_store = AzureSearch(
+    @cached_property
+    def rag_vector_store(self):
+        """Azure Search vector store for RAG index"""
+        return AzureSearch(
             azure_search_endpoint=self.azure_search_service_endpoint,
             azure_search_key=self.azure_search_api_key,
             index_name="rag-idx",
             embedding_function=self.embeddings,
             fields=self.rag_idx_fields
         )
+
+
+@lru_cache(maxsize=None)
+def get_azure_services() -> AzureServices:
+    """Process-wide shared AzureServices instance"""
+    services = AzureServices()
+    # Resolve the dimension at import time, before the event loop is serving
+    # requests; the vector store fields need it and the probe is a blocking call
+    services.embedding_dimension
+    return services
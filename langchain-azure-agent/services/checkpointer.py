@@ -0,0 +1,415 @@
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+from collections import OrderedDict
+from copy import copy
+from typing import Any, AsyncIterator, Iterator, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+
+
+CHECKPOINT_DB_PATH = os.environ.get('CHECKPOINT_DB_PATH', 'checkpoints.sqlite')
+CHECKPOINT_CACHE_SIZE = int(os.environ.get('CHECKPOINT_CACHE_SIZE', '256'))  # channel values kept in RAM
+CHECKPOINT_KEEP = int(os.environ.get('CHECKPOINT_KEEP', '20'))  # checkpoints kept per thread
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    channel_versions TEXT NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    type TEXT NOT NULL,
+    blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+class SqliteCheckpointSaver(BaseCheckpointSaver[str]):
+    """
+    LangGraph checkpointer persisted in a SQLite database (WAL mode)
+
+    Channel values are stored once per version, like `InMemorySaver`, and
+    only read when a checkpoint is loaded, so resuming a chat costs nothing
+    until the agent next runs. Recently used values stay deserialized in a
+    small LRU cache. After every checkpoint only the newest `keep` per
+    thread are kept, together with the values and writes they reference.
+    """
+
+    def __init__(
+        self,
+        path: str = CHECKPOINT_DB_PATH,
+        *,
+        cache_size: int = CHECKPOINT_CACHE_SIZE,
+        keep: int = CHECKPOINT_KEEP,
+        serde=None,
+    ):
+        super().__init__(serde=serde)
+        self.keep = max(keep, 1)
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.RLock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    # -- helpers ---------------------------------------------------------
+
+    def _cache_get(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return True, copy(self._cache[key])
+        return False, None
+
+    def _cache_put(self, key, value):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[key] = value
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _load_blobs(self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions) -> dict:
+        channel_values = {}
+        missing = []
+        for channel, version in versions.items():
+            hit, value = self._cache_get((thread_id, checkpoint_ns, channel, str(version)))
+            if hit:
+                channel_values[channel] = value
+            else:
+                missing.append((channel, str(version)))
+        for channel, version in missing:
+            row = self.conn.execute(
+                "SELECT type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? "
+                "AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, version),
+            ).fetchone()
+            if row is None or row[0] == "empty":
+                continue
+            value = self.serde.loads_typed((row[0], row[1]))
+            self._cache_put((thread_id, checkpoint_ns, channel, version), value)
+            channel_values[channel] = copy(value)
+        return channel_values
+
+    def _to_tuple(self, row: Tuple) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, type_, checkpoint_b, metadata_type, metadata_b = row
+        checkpoint = self.serde.loads_typed((type_, checkpoint_b))
+        writes = self.conn.execute(
+            "SELECT task_id, channel, type, value FROM writes WHERE thread_id = ? "
+            "AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint={
+                **checkpoint,
+                "channel_values": self._load_blobs(
+                    thread_id, checkpoint_ns, checkpoint["channel_versions"]),
+            },
+            metadata=self.serde.loads_typed((metadata_type, metadata_b)),
+            pending_writes=[
+                (task_id, channel, self.serde.loads_typed((t, v)))
+                for task_id, channel, t, v in writes
+            ],
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_id,
+                    }
+                }
+                if parent_id
+                else None
+            ),
+        )
+
+    def _compact(self, thread_id: str, checkpoint_ns: str):
+        """Drop all but the newest `keep` checkpoints of a thread and anything only they used"""
+        params = (thread_id, checkpoint_ns)
+        cutoff = self.conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT 1 OFFSET ?",
+            params + (self.keep - 1,),
+        ).fetchone()
+        if cutoff is None:
+            return
+        self.conn.execute(
+            "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+            params + cutoff)
+        self.conn.execute(
+            "DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id < ?",
+            params + cutoff)
+        self.conn.execute(
+            """
+            DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND NOT EXISTS (
+                SELECT 1 FROM checkpoints c, json_each(c.channel_versions) v
+                WHERE c.thread_id = blobs.thread_id AND c.checkpoint_ns = blobs.checkpoint_ns
+                AND v.key = blobs.channel AND CAST(v.value AS TEXT) = blobs.version
+            )
+            """,
+            params)
+
+    # -- BaseCheckpointSaver -----------------------------------------------
+
+    def has_thread(self, thread_id: str) -> bool:
+        """Whether any checkpoint is stored for `thread_id` (without loading it)"""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT 1 FROM checkpoints WHERE thread_id = ? LIMIT 1", (thread_id,)
+            ).fetchone() is not None
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        query = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, "
+            "checkpoint, metadata_type, metadata FROM checkpoints "
+            "WHERE thread_id = ? AND checkpoint_ns = ?"
+        )
+        params: Tuple = (thread_id, checkpoint_ns)
+        if checkpoint_id := get_checkpoint_id(config):
+            query += " AND checkpoint_id = ?"
+            params += (checkpoint_id,)
+        else:
+            query += " ORDER BY checkpoint_id DESC LIMIT 1"
+        with self._lock:
+            row = self.conn.execute(query, params).fetchone()
+            if row is None:
+                return None
+            result = self._to_tuple(row)
+        if checkpoint_id:
+            # Keep the caller's config, as InMemorySaver does
+            result = result._replace(config=config)
+        return result
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        query = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, "
+            "checkpoint, metadata_type, metadata FROM checkpoints"
+        )
+        where, params = [], []
+        if config:
+            where.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                where.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                where.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            where.append("checkpoint_id < ?")
+            params.append(before_id)
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self._lock:
+            rows = self.conn.execute(query, params).fetchall()
+        for row in rows:
+            if limit is not None and limit <= 0:
+                break
+            if filter:
+                metadata = self.serde.loads_typed((row[6], row[7]))
+                if not all(metadata.get(k) == v for k, v in filter.items()):
+                    continue
+            if limit is not None:
+                limit -= 1
+            with self._lock:
+                item = self._to_tuple(row)
+            yield item
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        c = checkpoint.copy()
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        values = c.pop("channel_values")
+        blobs = []
+        for channel, version in new_versions.items():
+            if channel in values:
+                type_, blob = self.serde.dumps_typed(values[channel])
+            else:
+                type_, blob = "empty", b""
+            blobs.append((thread_id, checkpoint_ns, channel, str(version), type_, blob))
+        type_, checkpoint_b = self.serde.dumps_typed(c)
+        metadata_type, metadata_b = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        channel_versions = json.dumps({k: str(v) for k, v in c["channel_versions"].items()})
+
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", blobs)
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, checkpoint["id"],
+                     config["configurable"].get("checkpoint_id"),
+                     type_, checkpoint_b, metadata_type, metadata_b, channel_versions))
+                self._compact(thread_id, checkpoint_ns)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            # Values we just wrote are the ones the next step will read
+            for channel, version in new_versions.items():
+                if channel in values:
+                    self._cache_put((thread_id, checkpoint_ns, channel, str(version)), values[channel])
+
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, blob = self.serde.dumps_typed(value)
+            rows.append((thread_id, checkpoint_ns, checkpoint_id, task_id,
+                         WRITES_IDX_MAP.get(channel, idx), channel, type_, blob, task_path))
+        # Special writes (negative idx) replace earlier ones; regular writes are kept if present
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [row for row in rows if row[4] < 0])
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [row for row in rows if row[4] >= 0])
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for table in ("checkpoints", "blobs", "writes"):
+                    self.conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            for key in [k for k in self._cache if k[0] == thread_id]:
+                del self._cache[key]
+
+    # The async methods run the sync ones in a worker thread (they serialize on
+    # the connection lock), so SQLite I/O and compaction never block the loop
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        next_v = current_v + 1
+        next_h = random.random()
+        return f"{next_v:032}.{next_h:016}"
@@ -1,6 +1,11 @@
+import asyncio
+import multiprocessing
 import os
+import time
 import chainlit as cl
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Optional, Tuple
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
@@ -15,13 +20,49 @@ from langchain_community.document_loaders import (
 )
 
 
+# Formats whose local parsers are CPU-bound; these are parsed in worker
+# processes so several uploads can be parsed at once without holding the GIL
+PROCESS_POOL_MIMES = {
+    "application/pdf",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+}
+
+PARSER_PROCESSES = int(os.getenv("PARSER_PROCESSES", str(min(4, os.cpu_count() or 1))))
+
+_parser_pool: Optional[ProcessPoolExecutor] = None
+
+
+@lru_cache(maxsize=None)
+def get_text_splitter() -> RecursiveCharacterTextSplitter:
+    """Splitter shared by every loader in this process (building the tiktoken encoder is not free)"""
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        model_name="gpt-4o",
+        chunk_size=50000,
+        chunk_overlap=5000,
+    )
+
+
+def get_parser_pool() -> ProcessPoolExecutor:
+    global _parser_pool
+    if _parser_pool is None:
+        # spawn rather than fork: the server process runs threads
+        _parser_pool = ProcessPoolExecutor(
+            max_workers=PARSER_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _parser_pool
+
+
+def _parse_in_worker(file_mime: str, file_path: str) -> Tuple[List[Document], float, float]:
+    # Runs in a worker process, which keeps its own splitter between files
+    return AsyncLoader().load_and_split(file_mime, file_path)
+
+
 class AsyncLoader:
     def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-            model_name="gpt-4o",
-            chunk_size=50000,
-            chunk_overlap=5000,
-        )
+        self.text_splitter = get_text_splitter()
         self.document_intelligence_endpoint = os.getenv(
             "DOCUMENT_INTELLIGENCE_ENDPOINT")
         self.document_intelligence_api_key = os.getenv(
@@ -29,13 +70,31 @@ class AsyncLoader:
         self.api_model = "prebuilt-layout"
         self.mode = "markdown"
 
+    def load_and_split(
+        self, file_mime: str, file_path: str
+    ) -> Tuple[List[Document], float, float]:
+        """Parse and split a file, returning the chunks and the seconds spent in each step"""
+        start = time.perf_counter()
+        loader = self._get_loader(file_mime, file_path)
+        docs = loader.load()
+        parsed = time.perf_counter()
+        split_docs = self.text_splitter.split_documents(docs)
+        return split_docs, parsed - start, time.perf_counter() - parsed
+
+    async def aload_and_split(
+        self, file_mime: str, file_path: str
+    ) -> Tuple[List[Document], float, float]:
+        if file_mime in PROCESS_POOL_MIMES:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                get_parser_pool(), _parse_in_worker, file_mime, file_path)
+        return await cl.make_async(self.load_and_split)(file_mime, file_path)
+
     async def aload(
         self, file_name: str, file_mime: str, file_path: str
     ) -> List[Document]:
         documents = []
-        loader = self._get_loader(file_mime, file_path)
-        docs = await cl.make_async(loader.load)()
-        split_docs = await self.text_splitter.atransform_documents(docs)
+        split_docs, _, _ = await self.aload_and_split(file_mime, file_path)
 
         for doc in split_docs:
             doc.metadata["thread_id"] = cl.user_session.get("current_thread")
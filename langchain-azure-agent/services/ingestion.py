@@ -0,0 +1,126 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import List, Sequence
+
+from langchain_core.documents import Document
+
+from services.document_loader import AsyncLoader, PARSER_PROCESSES
+
+
+PARSE_CONCURRENCY = int(os.getenv("INGEST_PARSE_CONCURRENCY", str(PARSER_PROCESSES)))
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "16"))  # chunks per embedding request
+UPLOAD_CONCURRENCY = int(os.getenv("INGEST_UPLOAD_CONCURRENCY", "2"))  # batches in flight
+
+
+@dataclass
+class IngestFile:
+    name: str
+    mime: str
+    path: str
+
+
+@dataclass
+class IngestReport:
+    """Chunks produced per file plus where the time went"""
+
+    documents: List[List[Document]] = field(default_factory=list)
+    uploaded: int = 0
+    parse_seconds: float = 0.0
+    split_seconds: float = 0.0
+    embed_seconds: float = 0.0
+    upload_seconds: float = 0.0
+    total_seconds: float = 0.0
+    file_seconds: List[float] = field(default_factory=list)
+
+    @property
+    def all_documents(self) -> List[Document]:
+        return [doc for docs in self.documents for doc in docs]
+
+    def summary(self, files: Sequence[IngestFile]) -> str:
+        lines = [
+            f"{len(files)} file(s), {len(self.all_documents)} chunk(s), "
+            f"{self.uploaded} uploaded in {self.total_seconds:.2f}s",
+            f"parse {self.parse_seconds:.2f}s, split {self.split_seconds:.2f}s, "
+            f"embed {self.embed_seconds:.2f}s, upload {self.upload_seconds:.2f}s "
+            "(summed across concurrent work)",
+        ]
+        for f, seconds, docs in zip(files, self.file_seconds, self.documents):
+            lines.append(f"- {f.name}: {len(docs)} chunk(s), {seconds:.2f}s")
+        return "\n".join(lines)
+
+
+async def ingest_files(
+    files: Sequence[IngestFile],
+    thread_id: str,
+    embeddings,
+    vector_store,
+    min_documents_to_upload: int = 2,
+) -> IngestReport:
+    """
+    Parse, split, embed and upload `files` as one pipeline
+
+    Files are parsed concurrently (CPU-heavy formats in a process pool) and
+    their chunks are embedded and uploaded in batches while later files are
+    still parsing. Nothing is uploaded unless the upload produces at least
+    `min_documents_to_upload` chunks in total, because a single chunk is put
+    straight into the conversation instead.
+    """
+    report = IngestReport(documents=[[] for _ in files], file_seconds=[0.0] * len(files))
+    started = time.perf_counter()
+    loader = AsyncLoader()
+    parse_slots = asyncio.Semaphore(max(PARSE_CONCURRENCY, 1))
+    upload_slots = asyncio.Semaphore(max(UPLOAD_CONCURRENCY, 1))
+    pending: List[Document] = []
+    uploads: List[asyncio.Task] = []
+    produced = 0
+
+    async def upload(batch: List[Document]):
+        async with upload_slots:
+            t0 = time.perf_counter()
+            texts = [doc.page_content for doc in batch]
+            vectors = await embeddings.aembed_documents(texts)
+            t1 = time.perf_counter()
+            await vector_store.aadd_embeddings(
+                list(zip(texts, vectors)), [doc.metadata for doc in batch])
+            report.embed_seconds += t1 - t0
+            report.upload_seconds += time.perf_counter() - t1
+            report.uploaded += len(batch)
+
+    def flush(final: bool = False):
+        if produced < min_documents_to_upload:
+            return
+        while len(pending) >= EMBED_BATCH_SIZE or (final and pending):
+            batch = pending[:EMBED_BATCH_SIZE]
+            del pending[:EMBED_BATCH_SIZE]
+            uploads.append(asyncio.create_task(upload(batch)))
+
+    async def parse(index: int, f: IngestFile):
+        nonlocal produced
+        async with parse_slots:
+            t0 = time.perf_counter()
+            docs, parse_seconds, split_seconds = await loader.aload_and_split(f.mime, f.path)
+            report.file_seconds[index] = time.perf_counter() - t0
+        report.parse_seconds += parse_seconds
+        report.split_seconds += split_seconds
+        for doc in docs:
+            doc.metadata["thread_id"] = thread_id
+            doc.metadata["title"] = f.name
+        report.documents[index] = docs
+        pending.extend(docs)
+        produced += len(docs)
+        flush()
+
+    parses = [asyncio.create_task(parse(i, f)) for i, f in enumerate(files)]
+    try:
+        await asyncio.gather(*parses)
+        flush(final=True)
+        await asyncio.gather(*uploads)
+    except BaseException:
+        for task in parses + uploads:
+            task.cancel()
+        raise
+
+    report.total_seconds = time.perf_counter() - started
+    return report
@@ -0,0 +1,107 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Union
+
+from langchain_core.messages import BaseMessage
+from langchain_core.messages.utils import count_tokens_approximately
+
+
+@dataclass
+class _Cut:
+    """Where the previous trim of a thread started, and the tokens from there to its end"""
+
+    start: int
+    start_id: str
+    end: int
+    end_id: str
+    tokens: int
+
+
+class MessageTrimmer:
+    """
+    Equivalent of `trim_messages(strategy="last", token_counter=count_tokens_approximately)`
+    that doesn't re-count the whole thread before every model call
+
+    Token counts are cached per message id. The approximate counter rounds
+    per message, so the count of a list is the sum of its messages' counts.
+    Within a thread messages are only appended, and the oldest message that
+    still fits can only move forward, so each trim resumes from the previous
+    cut point and only counts the new messages.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        start_on: Union[str, Sequence[str]] = "human",
+        end_on: Union[str, Sequence[str]] = ("human", "tool"),
+        cache_size: int = 50000,
+        max_threads: int = 1024,
+    ):
+        self.max_tokens = max_tokens
+        self.start_on = {start_on} if isinstance(start_on, str) else set(start_on)
+        self.end_on = {end_on} if isinstance(end_on, str) else set(end_on)
+        self.cache_size = cache_size
+        self.max_threads = max_threads
+        self._counts: OrderedDict = OrderedDict()
+        self._cuts: OrderedDict = OrderedDict()
+
+    def count(self, message: BaseMessage) -> int:
+        # The count only depends on lengths, so the content length guards
+        # against a message being replaced under the same id
+        if not message.id or not isinstance(message.content, str):
+            return count_tokens_approximately([message])
+        key = (message.id, message.type, len(message.content))
+        tokens = self._counts.get(key)
+        if tokens is None:
+            tokens = count_tokens_approximately([message])
+            self._counts[key] = tokens
+            if len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        return tokens
+
+    def _resume(self, messages: Sequence[BaseMessage], end: int) -> Optional[_Cut]:
+        thread_key = messages[0].id
+        cut = self._cuts.get(thread_key) if thread_key else None
+        if (
+            cut is None
+            or cut.end > end
+            or messages[cut.start].id != cut.start_id
+            or messages[cut.end - 1].id != cut.end_id
+        ):
+            return None
+        self._cuts.move_to_end(thread_key)
+        return cut
+
+    def trim(self, messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+        # Drop trailing messages that can't end the window
+        end = len(messages)
+        while end and messages[end - 1].type not in self.end_on:
+            end -= 1
+        if not end:
+            return []
+
+        cut = self._resume(messages, end)
+        if cut:
+            start = cut.start
+            tokens = cut.tokens + sum(self.count(m) for m in messages[cut.end:end])
+        else:
+            start = 0
+            tokens = sum(self.count(m) for m in messages[:end])
+
+        # Keep the longest suffix that fits
+        while tokens > self.max_tokens and start < end:
+            tokens -= self.count(messages[start])
+            start += 1
+
+        thread_key = messages[0].id
+        if thread_key and start < end:
+            self._cuts[thread_key] = _Cut(
+                start, messages[start].id, end, messages[end - 1].id, tokens)
+            self._cuts.move_to_end(thread_key)
+            if len(self._cuts) > self.max_threads:
+                self._cuts.popitem(last=False)
+
+        # The window must open on one of the start_on types
+        while start < end and messages[start].type not in self.start_on:
+            start += 1
+        return list(messages[start:end])
@@ -1,10 +1,10 @@
 import chainlit as cl
 from langchain.tools import tool
-from services.azure_services import AzureServices
+from services.azure_services import get_azure_services
 from pydantic import BaseModel, Field
 
 
-azure_services = AzureServices()
+azure_services = get_azure_services()
 
 
 class SearchInput(BaseModel):
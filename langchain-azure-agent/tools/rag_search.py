@@ -1,9 +1,9 @@
 from langchain.tools import tool
-from services.azure_services import AzureServices
+from services.azure_services import get_azure_services
 from pydantic import BaseModel, Field
 
 
-azure_services = AzureServices()
+azure_services = get_azure_services()
 
 
 class SearchInput(BaseModel):
@@ -1,4 +1,7 @@
 from enum import auto, Enum
+from collections import OrderedDict
+import base64
+import hashlib
 import json
 import dataclasses
 from typing import List
@@ -23,6 +26,80 @@ class SeparatorStyle(Enum):
     LLAMA_2 = auto()
 
 
+def expand2square(pil_img, background_color=(122, 116, 104)):
+    width, height = pil_img.size
+    if width == height:
+        return pil_img
+    elif width > height:
+        result = Image.new(pil_img.mode, (width, width), background_color)
+        result.paste(pil_img, (0, (width - height) // 2))
+        return result
+    else:
+        result = Image.new(pil_img.mode, (height, height), background_color)
+        result.paste(pil_img, ((height - width) // 2, 0))
+        return result
+
+
+def process_image(image, image_process_mode):
+    if image_process_mode == "Pad":
+        image = expand2square(image)
+    elif image_process_mode in ["Default", "Crop"]:
+        pass
+    elif image_process_mode == "Resize":
+        image = image.resize((336, 336))
+    else:
+        raise ValueError(f"Invalid image_process_mode: {image_process_mode}")
+    max_hw, min_hw = max(image.size), min(image.size)
+    aspect_ratio = max_hw / min_hw
+    max_len, min_len = 800, 400
+    shortest_edge = int(min(max_len / aspect_ratio, min_len, min_hw))
+    longest_edge = int(shortest_edge * aspect_ratio)
+    W, H = image.size
+    if longest_edge != max(image.size):
+        if H > W:
+            H, W = longest_edge, shortest_edge
+        else:
+            H, W = shortest_edge, longest_edge
+        image = image.resize((W, H))
+    return image
+
+
+# Processed images shared by all sessions, keyed by (content hash, process mode).
+# Each entry is [processed PIL image, base64 PNG (encoded on first use)].
+IMAGE_CACHE_SIZE = 64
+processed_images = OrderedDict()
+
+
+def image_hash(image):
+    """Content hash of a PIL image, computed once per image object"""
+    digest = getattr(image, "llava_content_hash", None)
+    if digest is None:
+        h = hashlib.sha256(f"{image.mode}{image.size}".encode())
+        h.update(image.tobytes())
+        digest = h.hexdigest()
+        image.llava_content_hash = digest
+    return digest
+
+
+def get_processed_image(image, image_process_mode, return_pil=False):
+    key = (image_hash(image), image_process_mode)
+    entry = processed_images.get(key)
+    if entry is None:
+        entry = [process_image(image, image_process_mode), None]
+        processed_images[key] = entry
+        while len(processed_images) > IMAGE_CACHE_SIZE:
+            processed_images.popitem(last=False)
+    else:
+        processed_images.move_to_end(key)
+    if return_pil:
+        return entry[0]
+    if entry[1] is None:
+        buffered = io.BytesIO()
+        entry[0].save(buffered, format="PNG")
+        entry[1] = base64.b64encode(buffered.getvalue()).decode()
+    return entry[1]
+
+
 @dataclasses.dataclass
 class Conversation:
     """A class that keeps all conversation history."""
@@ -38,72 +115,102 @@ class Conversation:
 
     skip_next: bool = False
 
-    def get_prompt(self):
-        messages = self.messages
+    # Rendered prompt cache: one (role, message, segment) entry per rendered
+    # message, plus the full prompt and the offset where each segment ends.
+    _rendered: list = dataclasses.field(default=None, init=False, repr=False, compare=False)
+    _prompt: str = dataclasses.field(default="", init=False, repr=False, compare=False)
+    _segment_ends: list = dataclasses.field(default=None, init=False, repr=False, compare=False)
+
+    def _render_head(self):
+        if self.sep_style in (SeparatorStyle.SINGLE, SeparatorStyle.TWO, SeparatorStyle.MPT):
+            return self.system + self.sep
+        elif self.sep_style == SeparatorStyle.LLAMA_2:
+            return ""
+        elif self.sep_style == SeparatorStyle.PLAIN:
+            return self.system
+        raise ValueError(f"Invalid style: {self.sep_style}")
+
+    def _render_message(self, i, role, message):
         if self.sep_style == SeparatorStyle.SINGLE:
-            ret = self.system + self.sep
-            for role, message in messages:
-                if message:
-                    if type(message) is tuple:
-                        message, _, _ = message
-                    ret += role + ": " + message + self.sep
-                else:
-                    ret += role + ":"
+            if message:
+                if type(message) is tuple:
+                    message, _, _ = message
+                return role + ": " + message + self.sep
+            return role + ":"
         elif self.sep_style == SeparatorStyle.TWO:
             seps = [self.sep, self.sep2]
-            ret = self.system + seps[0]
-            for i, (role, message) in enumerate(messages):
-                if message:
-                    if type(message) is tuple:
-                        message, _, _ = message
-                    ret += role + ": " + message + seps[i % 2]
-                else:
-                    ret += role + ":"
+            if message:
+                if type(message) is tuple:
+                    message, _, _ = message
+                return role + ": " + message + seps[i % 2]
+            return role + ":"
         elif self.sep_style == SeparatorStyle.MPT:
-            ret = self.system + self.sep
-            for role, message in messages:
-                if message:
-                    if type(message) is tuple:
-                        message, _, _ = message
-                    ret += role + message + self.sep
-                else:
-                    ret += role
+            if message:
+                if type(message) is tuple:
+                    message, _, _ = message
+                return role + message + self.sep
+            return role
         elif self.sep_style == SeparatorStyle.LLAMA_2:
             wrap_sys = lambda msg: f"<<SYS>>\n{msg}\n<</SYS>>\n\n"
             wrap_inst = lambda msg: f"[INST] {msg} [/INST]"
-            ret = ""
-
-            for i, (role, message) in enumerate(messages):
-                if i == 0:
-                    assert message, "first message should not be none"
-                    assert role == self.roles[0], "first message should come from user"
-                if message:
-                    if type(message) is tuple:
-                        message, _, _ = message
-                    if i == 0:
-                        message = wrap_sys(self.system) + message
-                    if i % 2 == 0:
-                        message = wrap_inst(message)
-                        ret += self.sep + message
-                    else:
-                        ret += " " + message + " " + self.sep2
-                else:
-                    ret += ""
-            ret = ret.lstrip(self.sep)
+            if i == 0:
+                assert message, "first message should not be none"
+                assert role == self.roles[0], "first message should come from user"
+            if not message:
+                return ""
+            if type(message) is tuple:
+                message, _, _ = message
+            if i == 0:
+                message = wrap_sys(self.system) + message
+            if i % 2 == 0:
+                segment = self.sep + wrap_inst(message)
+                return segment.lstrip(self.sep) if i == 0 else segment
+            return " " + message + " " + self.sep2
         elif self.sep_style == SeparatorStyle.PLAIN:
             seps = [self.sep, self.sep2]
-            ret = self.system
-            for i, (role, message) in enumerate(messages):
-                if message:
-                    if type(message) is tuple:
-                        message, _, _ = message
-                    ret += message + seps[i % 2]
-                else:
-                    ret += ""
-        else:
-            raise ValueError(f"Invalid style: {self.sep_style}")
+            if message:
+                if type(message) is tuple:
+                    message, _, _ = message
+                return message + seps[i % 2]
+            return ""
+        raise ValueError(f"Invalid style: {self.sep_style}")
 
-        return ret
+    def get_prompt(self):
+        """
+        Render the prompt, reusing the cached rendering of every message that
+        hasn't changed since the last call and only rendering new turns.
+        """
+        if self._rendered is None:
+            self._rendered = []
+            self._prompt = self._render_head()
+            self._segment_ends = []
+
+        # Find the first cached message that was replaced or edited
+        keep = 0
+        for (role, message), cached in zip(self.messages, self._rendered):
+            if cached[0] is not role or cached[1] is not message:
+                break
+            keep += 1
+
+        if keep < len(self._rendered):
+            head_end = self._segment_ends[keep - 1] if keep else len(self._render_head())
+            self._prompt = self._prompt[:head_end]
+            del self._rendered[keep:]
+            del self._segment_ends[keep:]
+
+        if keep < len(self.messages):
+            segments = []
+            end = len(self._prompt)
+            for i in range(keep, len(self.messages)):
+                role, message = self.messages[i]
+                segment = self._render_message(i, role, message)
+                self._rendered.append((role, message, segment))
+                segments.append(segment)
+                end += len(segment)
+                self._segment_ends.append(end)
+            self._prompt += "".join(segments)
+
+        return self._prompt
 
     def append_message(self, role, message):
         self.messages.append([role, message])
@@ -113,62 +220,21 @@ class Conversation:
         for i, (role, msg) in enumerate(self.messages[self.offset :]):
             if i % 2 == 0:
                 if type(msg) is tuple:
-                    import base64
-                    from io import BytesIO
-                    from PIL import Image
-
                     msg, image, image_process_mode = msg
                     if image == None:
                         continue
-                    if image_process_mode == "Pad":
-
-                        def expand2square(pil_img, background_color=(122, 116, 104)):
-                            width, height = pil_img.size
-                            if width == height:
-                                return pil_img
-                            elif width > height:
-                                result = Image.new(
-                                    pil_img.mode, (width, width), background_color
-                                )
-                                result.paste(pil_img, (0, (width - height) // 2))
-                                return result
-                            else:
-                                result = Image.new(
-                                    pil_img.mode, (height, height), background_color
-                                )
-                                result.paste(pil_img, ((height - width) // 2, 0))
-                                return result
-
-                        image = expand2square(image)
-                    elif image_process_mode in ["Default", "Crop"]:
-                        pass
-                    elif image_process_mode == "Resize":
-                        image = image.resize((336, 336))
-                    else:
-                        raise ValueError(
-                            f"Invalid image_process_mode: {image_process_mode}"
-                        )
-                    max_hw, min_hw = max(image.size), min(image.size)
-                    aspect_ratio = max_hw / min_hw
-                    max_len, min_len = 800, 400
-                    shortest_edge = int(min(max_len / aspect_ratio, min_len, min_hw))
-                    longest_edge = int(shortest_edge * aspect_ratio)
-                    W, H = image.size
-                    if longest_edge != max(image.size):
-                        if H > W:
-                            H, W = longest_edge, shortest_edge
-                        else:
-                            H, W = shortest_edge, longest_edge
-                        image = image.resize((W, H))
-                    if return_pil:
-                        images.append(image)
-                    else:
-                        buffered = BytesIO()
-                        image.save(buffered, format="PNG")
-                        img_b64_str = base64.b64encode(buffered.getvalue()).decode()
-                        images.append(img_b64_str)
+                    images.append(
+                        get_processed_image(image, image_process_mode, return_pil)
+                    )
         return images
 
+    def count_images(self):
+        return sum(
+            1
+            for i, (role, msg) in enumerate(self.messages[self.offset :])
+            if i % 2 == 0 and type(msg) is tuple and msg[1] is not None
+        )
+
     def copy(self):
         return Conversation(
             system=self.system,
@@ -182,7 +248,7 @@ class Conversation:
         )
 
     def dict(self):
-        if len(self.get_images()) > 0:
+        if self.count_images() > 0:
             return {
                 "system": self.system,
                 "roles": self.roles,
@@ -234,6 +300,14 @@ async def request(conversation: Conversation, settings):
 
     pload["images"] = conversation.get_images()
 
+    # The worker resends prompt + full output on every chunk; only the text past
+    # `consumed` is new. Trailing whitespace is held back so the final output
+    # matches the stripped text.
+    prompt_len = len(pload["prompt"])
+    consumed = 0
+    output_parts = []
+    error_output = None
+
     async with aiohttp.ClientSession() as session:
         async with session.post(
             CONTROLLER_URL + "/worker_generate_stream",
@@ -242,24 +316,35 @@ async def request(conversation: Conversation, settings):
             timeout=10,
         ) as response:
             chainlit_message = cl.Message(content="")
+            pending = b""
             async for chunk in response.content.iter_any():
-                for json_str in chunk.decode().split("\0"):
+                pending += chunk
+                *json_strs, pending = pending.split(b"\0")
+                for json_str in json_strs:
                     if json_str:
                         data = json.loads(json_str)
 
                         if data["error_code"] == 0:
-                            output = data["text"][len(pload["prompt"]) :].strip()
-                            conversation.messages[-1][-1] = output + "▌"
-                            await chainlit_message.stream_token(
-                                output, is_sequence=True
-                            )
+                            new_text = data["text"][prompt_len + consumed :]
+                            if not output_parts:
+                                stripped = new_text.lstrip()
+                                consumed += len(new_text) - len(stripped)
+                                new_text = stripped
+                            new_text = new_text.rstrip()
+                            if new_text:
+                                consumed += len(new_text)
+                                output_parts.append(new_text)
+                                await chainlit_message.stream_token(new_text)
                         else:
-                            output = (
+                            error_output = (
                                 data["text"] + f" (error_code: {data['error_code']})"
                             )
-                            conversation.messages[-1][-1] = output
-                            chainlit_message.content = output
+                            chainlit_message.content = error_output
             await chainlit_message.send()
+
+    conversation.messages[-1][-1] = (
+        error_output if error_output is not None else "".join(output_parts)
+    )
     return conversation
 
 
@@ -326,7 +411,7 @@ async def main(message: cl.Message):
     settings = cl.user_session.get("settings")
 
     if image:
-        if len(conv.get_images(return_pil=True)) > 0:
+        if conv.count_images() > 0:
             # reset
             conv = default_conversation.copy()
         text = message.content[:1200]
@@ -2,6 +2,8 @@ import json
 import chainlit as cl
 from anthropic import AsyncAnthropic
 
+from tool_loop import TOOL_ROUNDS_EXCEEDED, final_text, run_tool_loop
+
 SYSTEM = "you are a helpful assistant."
 MODEL_NAME = "claude-3-5-sonnet-latest"
 c = AsyncAnthropic()
@@ -120,33 +122,12 @@ async def on_start():
 async def on_message(msg: cl.Message):
     chat_messages = cl.user_session.get("chat_messages")
     chat_messages.append({"role": "user", "content": msg.content})
-    response = await call_claude(chat_messages)
-
-    while response.stop_reason == "tool_use":
-        tool_use = next(block for block in response.content if block.type == "tool_use")
-        tool_result = await call_tool(tool_use)
-
-        messages = [
-            {"role": "assistant", "content": response.content},
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "tool_result",
-                        "tool_use_id": tool_use.id,
-                        "content": str(tool_result),
-                    }
-                ],
-            },
-        ]
+    # Every tool_use of a turn runs concurrently, so one round trip per turn
+    response, stats = await run_tool_loop(chat_messages, call_claude, call_tool)
+    if stats.capped:
+        await cl.Message(content=TOOL_ROUNDS_EXCEEDED).send()
 
-        chat_messages.extend(messages)
-        response = await call_claude(chat_messages)
-
-    final_response = next(
-        (block.text for block in response.content if hasattr(block, "text")),
-        None,
-    )
+    final_response = final_text(response)
 
     chat_messages = cl.user_session.get("chat_messages")
     chat_messages.append({"role": "assistant", "content": final_response})
@@ -8,6 +8,8 @@ import chainlit as cl
 import os
 from dotenv import load_dotenv
 
+from tool_loop import TOOL_ROUNDS_EXCEEDED, final_text, run_tool_loop
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -138,6 +140,12 @@ async def call_claude(chat_messages):
     return response
 
 
+async def dispatch_tool(tool_use):
+    if tool_use.name == "show_linear_ticket":
+        return await show_linear_ticket(**tool_use.input)
+    return await call_tool(tool_use)
+
+
 @cl.on_chat_start
 async def start_chat():
     cl.user_session.set("chat_messages", [])
@@ -148,36 +156,12 @@ async def start_chat():
 async def on_message(msg: cl.Message):
     chat_messages = cl.user_session.get("chat_messages")
     chat_messages.append({"role": "user", "content": msg.content})
-    response = await call_claude(chat_messages)
-
-    while response.stop_reason == "tool_use":
-        tool_use = next(block for block in response.content if block.type == "tool_use")
-        if tool_use.name == "show_linear_ticket":
-            tool_result = await show_linear_ticket(**tool_use.input)
-        else:
-            tool_result = await call_tool(tool_use)
-
-        messages = [
-            {"role": "assistant", "content": response.content},
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "tool_result",
-                        "tool_use_id": tool_use.id,
-                        "content": str(tool_result),
-                    }
-                ],
-            },
-        ]
-
-        chat_messages.extend(messages)
-        response = await call_claude(chat_messages)
+    # Every tool_use of a turn runs concurrently, so one round trip per turn
+    response, stats = await run_tool_loop(chat_messages, call_claude, dispatch_tool)
+    if stats.capped:
+        await cl.Message(content=TOOL_ROUNDS_EXCEEDED).send()
 
-    final_response = next(
-        (block.text for block in response.content if hasattr(block, "text")),
-        None,
-    )
+    final_response = final_text(response)
 
     chat_messages = cl.user_session.get("chat_messages")
     chat_messages.append({"role": "assistant", "content": final_response})
@@ -6,6 +6,7 @@ Simplified version with local Python executor instead of OpenAI's code interpret
 
 import os
 import json
+import time
 import base64
 from typing import List, Dict, Any, Optional
 
@@ -21,12 +22,15 @@ from tools import (
     show_tool_progress, 
     show_reasoning_summary
 )
+from kernel import kernel_pool
+from streaming_json import JsonStringFieldDecoder
 
 # ─────────────────── OpenAI Client Setup ────────────────────────────────────
 cl.instrument_openai()
 client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 MAX_ITER = 20
+CODE_STREAM_FPS = 10  # max UI updates per second for the live code preview
 DEV_PROMPT = "Talk in Ned Flanders style. You are a helpful assistant with access to local Python execution, web search, image generation, file search, and file upload capabilities. You can upload files to a persistent Python workspace and analyze them with code. IMPORTANT: When you see function calls for 'upload_file_to_workspace' or 'list_workspace_files' in the conversation history, acknowledge what files were uploaded or are available. Always check your recent function call results to understand what the user has done. Use tools when needed."
 # ─────────────────── Session Management ─────────────────────────────────────
 @cl.on_chat_start
@@ -106,6 +110,7 @@ async def _start():
     os.makedirs(ws_dir, exist_ok=True)
 
     cl.user_session.set("python_workspace_dir", ws_dir)
+    kernel_pool.warm()
     await cl.Message(f"Using per-chat workspace: `{ws_dir}`", author="System").send()
 
 
@@ -114,8 +119,14 @@ async def setup_agent(settings):
     """Handle settings updates"""
     cl.user_session.set("settings", settings)
 
+@cl.on_stop
+async def _stop():
+    """Interrupt any Python code still running for this chat"""
+    kernel_pool.interrupt(cl.user_session.get("id") or "default")
+
 @cl.on_chat_end
-def _cleanup():
+async def _cleanup():
+    await kernel_pool.release(cl.user_session.get("id") or "default")
     ws_dir = cl.user_session.get("python_workspace_dir")
     if ws_dir and os.path.isdir(ws_dir):
         try:
@@ -124,6 +135,14 @@ def _cleanup():
             pass
 
 # ─────────────────── Core GPT Interaction ───────────────────────────────────
+async def _finish_code_stream(code_stream: Dict[str, Any]):
+    """Flush any buffered code and close the code block of a live preview"""
+    message = code_stream["message"]
+    await message.stream_token(code_stream["pending"] + "\n```")
+    code_stream["pending"] = ""
+    await message.update()
+
+
 async def _ask_gpt(input_data, prev_id=None):
     """
     Send request to OpenAI API and handle streaming response
@@ -190,9 +209,8 @@ async def _ask_gpt(input_data, prev_id=None):
     assistant_text = ""
     reasoning_text = ""
     
-    # Track function call streaming
-    streaming_code_message = None
-    current_code = ""
+    # Track function call streaming: item_id -> live code preview state
+    code_streams: Dict[str, Dict[str, Any]] = {}
 
     # Process streaming response
     async for ev in stream:
@@ -241,58 +259,47 @@ async def _ask_gpt(input_data, prev_id=None):
             if ev.item.name == "execute_python_code":
                 streaming_code_message = cl.Message(
                     author="Code Generator",
-                    content="**Python Code Being Generated:**\n```python\n\n```"
+                    content="**Python Code Being Generated:**\n```python\n"
                 )
                 await streaming_code_message.send()
-                current_code = ""
+                code_streams[ev.item.id] = {
+                    "message": streaming_code_message,
+                    "decoder": JsonStringFieldDecoder("code"),
+                    "pending": "",
+                    "last_flush": 0.0,
+                }
                 
         elif ev.type == "response.function_call_arguments.delta":
             # Find the call and append arguments
             for call in calls:
                 if call["id"] == ev.item_id:
                     call["arguments"] += ev.delta
-                    
-                    # If this is Python code, stream the code generation
-                    if call["name"] == "execute_python_code" and streaming_code_message:
-                        try:
-                            # Try to parse the current arguments to extract code
-                            # We might have incomplete JSON, so we need to handle this carefully
-                            current_args_str = call["arguments"]
-                            
-                            # Try to find the code field in the JSON string
-                            if '"code":"' in current_args_str:
-                                # Extract everything after "code":"
-                                code_start = current_args_str.find('"code":"') + 8
-                                code_part = current_args_str[code_start:]
-                                
-                                # Find the end of the code string (look for unescaped quote)
-                                # This is a simple approach - we'll look for the pattern
-                                code_end = len(code_part)
-                                if '"}' in code_part:
-                                    code_end = code_part.find('"}')
-                                elif '",' in code_part:
-                                    code_end = code_part.find('",')
-                                
-                                new_code = code_part[:code_end]
-                                
-                                # Unescape the JSON string
-                                new_code = new_code.replace('\\"', '"').replace('\\n', '\n').replace('\\t', '\t')
-                                
-                                if new_code != current_code:
-                                    current_code = new_code
-                                    streaming_code_message.content = f"**Python Code Being Generated:**\n```python\n{current_code}\n```"
-                                    await streaming_code_message.update()
-                        except Exception as e:
-                            # If parsing fails, just continue - we'll get more data
-                            pass
                     break
 
+            # If this is Python code, decode only the new characters and
+            # push them to the UI at most CODE_STREAM_FPS times per second
+            code_stream = code_streams.get(ev.item_id)
+            if code_stream:
+                code_stream["pending"] += code_stream["decoder"].feed(ev.delta)
+                now = time.monotonic()
+                if code_stream["pending"] and now - code_stream["last_flush"] >= 1 / CODE_STREAM_FPS:
+                    await code_stream["message"].stream_token(code_stream["pending"])
+                    code_stream["pending"] = ""
+                    code_stream["last_flush"] = now
+
+        elif ev.type == "response.function_call_arguments.done":
+            code_stream = code_streams.pop(ev.item_id, None)
+            if code_stream:
+                await _finish_code_stream(code_stream)
+
         # Assistant text streaming
         elif ev.type == "response.output_text.delta":
             assistant_text += ev.delta
             await ans.stream_token(ev.delta)
 
     await ans.update()
+    for code_stream in code_streams.values():
+        await _finish_code_stream(code_stream)
 
     # Display reasoning summary if available
     if reasoning_text.strip() and settings.get("show_reasoning", True):
@@ -0,0 +1,361 @@
+"""
+Warm, pooled Python kernels for the local Python executor
+
+Each chat session gets its own long-lived worker process, so heavy imports
+(matplotlib, pandas, numpy) are paid once and variables survive between
+`execute_python_code` calls. A small number of spare workers are kept
+pre-spawned so a new session never waits for interpreter startup, and
+kernels that sit idle are shut down.
+
+Everything here is asyncio-native: running a cell never blocks the event
+loop, output is streamed back while the cell runs, the number of cells
+running at once is capped (extra ones wait in a queue), and a running cell
+can be interrupted without losing the session's variables.
+"""
+
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+
+KERNEL_POOL_SIZE = int(os.getenv("PY_KERNEL_POOL_SIZE", "2"))  # warm spares
+KERNEL_MAX_KERNELS = int(os.getenv("PY_KERNEL_MAX_KERNELS", "16"))  # spares + bound sessions
+KERNEL_IDLE_TIMEOUT = float(os.getenv("PY_KERNEL_IDLE_TIMEOUT", "900"))  # seconds
+KERNEL_EXEC_TIMEOUT = float(os.getenv("PY_KERNEL_EXEC_TIMEOUT", "30"))  # seconds
+KERNEL_MAX_CONCURRENCY = int(os.getenv("PY_KERNEL_MAX_CONCURRENCY", "4"))  # cells running at once
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kernel_worker.py")
+STREAM_LIMIT = 16 * 1024 * 1024  # max size of a single protocol line
+
+OutputCallback = Callable[[str, str], Awaitable[None]]
+
+
+class KernelTimeout(Exception):
+    """Raised when a cell does not finish within the execution timeout; carries the output produced so far"""
+
+    def __init__(self, stdout: str = "", stderr: str = ""):
+        super().__init__("Code execution timed out")
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+class KernelDied(Exception):
+    """Raised when the worker process exits unexpectedly"""
+
+
+class Kernel:
+    """A single warm worker process speaking line-delimited JSON over stdin/stdout"""
+
+    def __init__(self, proc: asyncio.subprocess.Process):
+        self.proc = proc
+        self.session_id: Optional[str] = None
+        self.workspace_dir: Optional[str] = None
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.busy = False
+        # Set when a cell was interrupted and its "done" event hasn't been read yet
+        self.pending_done = False
+
+    @classmethod
+    async def spawn(cls, timeout: float = 60) -> "Kernel":
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-u", WORKER_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=STREAM_LIMIT,
+        )
+        kernel = cls(proc)
+        try:
+            await asyncio.wait_for(kernel._wait_for("ready"), timeout)
+        except BaseException:
+            kernel.kill()
+            raise
+        return kernel
+
+    async def _send(self, message: Dict[str, Any]):
+        try:
+            self.proc.stdin.write((json.dumps(message) + "\n").encode())
+            await self.proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError, OSError) as e:
+            raise KernelDied(str(e))
+
+    async def _next_event(self) -> Dict[str, Any]:
+        while True:
+            line = await self.proc.stdout.readline()
+            if not line:
+                raise KernelDied("Python kernel exited unexpectedly")
+            try:
+                return json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+    async def _wait_for(self, event_type: str, on_output: Optional[OutputCallback] = None) -> Dict[str, Any]:
+        while True:
+            event = await self._next_event()
+            if event.get("type") == event_type:
+                return event
+            if event.get("type") == "stream" and on_output:
+                await on_output(event["name"], event["text"])
+
+    async def _drain_pending(self, timeout: float = 5):
+        """Skip what is left of an interrupted cell so the next one starts clean"""
+        if not self.pending_done:
+            return
+        try:
+            await asyncio.wait_for(self._wait_for("done"), timeout)
+        except asyncio.TimeoutError:
+            self.kill()
+            raise KernelDied("Python kernel did not respond to interrupt")
+        self.pending_done = False
+
+    async def bind(self, session_id: str, workspace_dir: str):
+        """Attach this kernel to a session and move it into its workspace"""
+        await self._send({"op": "init", "cwd": workspace_dir})
+        await asyncio.wait_for(self._wait_for("init_done"), 10)
+        self.session_id = session_id
+        self.workspace_dir = workspace_dir
+
+    async def execute(
+        self,
+        code: str,
+        on_output: Optional[OutputCallback] = None,
+        timeout: float = KERNEL_EXEC_TIMEOUT,
+    ) -> Dict[str, Any]:
+        """
+        Run a cell, forwarding stdout/stderr to `on_output` as it is produced
+
+        On timeout or cancellation the cell is interrupted (KeyboardInterrupt
+        in the worker), so the kernel and its variables stay usable.
+        """
+        async with self.lock:
+            await self._drain_pending()
+            self.busy = True
+            self.last_used = time.monotonic()
+            stdout: List[str] = []
+            stderr: List[str] = []
+
+            async def collect(name: str, text: str):
+                (stdout if name == "stdout" else stderr).append(text)
+                if on_output:
+                    await on_output(name, text)
+
+            await self._send({"op": "exec", "code": code})
+            try:
+                done = await asyncio.wait_for(self._wait_for("done", collect), timeout)
+            except asyncio.TimeoutError:
+                self.interrupt()
+                self.pending_done = True
+                raise KernelTimeout("".join(stdout), "".join(stderr))
+            except asyncio.CancelledError:
+                self.interrupt()
+                self.pending_done = True
+                raise
+            finally:
+                self.busy = False
+                self.last_used = time.monotonic()
+
+            return {
+                "stdout": "".join(stdout),
+                "stderr": "".join(stderr),
+                "return_code": done["return_code"],
+                "generated_files": done.get("generated_files", []),
+            }
+
+    def interrupt(self):
+        """Raise KeyboardInterrupt inside the running cell"""
+        if not self.is_alive():
+            return
+        try:
+            self.proc.send_signal(signal.SIGINT)
+        except (ValueError, OSError):
+            # No SIGINT delivery on this platform - give up on the kernel
+            self.kill()
+
+    def is_alive(self) -> bool:
+        return self.proc.returncode is None
+
+    def kill(self):
+        if self.is_alive():
+            try:
+                self.proc.kill()
+            except ProcessLookupError:
+                pass
+
+    async def shutdown(self):
+        if not self.is_alive():
+            return
+        try:
+            await self._send({"op": "shutdown"})
+            await asyncio.wait_for(self.proc.wait(), 2)
+        except Exception:
+            self.kill()
+
+
+class KernelPool:
+    """
+    Bounded pool of worker processes
+
+    Spare kernels are spawned ahead of time in the background. A session takes
+    a spare on its first execution and keeps it until it is released, evicted
+    for being idle, or evicted to make room when the pool is full. At most
+    `max_concurrency` cells run at once across all sessions; the rest queue.
+    """
+
+    def __init__(
+        self,
+        size: int = KERNEL_POOL_SIZE,
+        max_kernels: int = KERNEL_MAX_KERNELS,
+        idle_timeout: float = KERNEL_IDLE_TIMEOUT,
+        max_concurrency: int = KERNEL_MAX_CONCURRENCY,
+    ):
+        self.size = size
+        self.max_kernels = max(max_kernels, 1)
+        self.idle_timeout = idle_timeout
+        self.max_concurrency = max(max_concurrency, 1)
+        self._spares: List[Kernel] = []
+        self._sessions: Dict[str, Kernel] = {}
+        self._pending = 0  # kernels being spawned or bound, in neither list yet
+        # session -> [lock, users] while its kernel is being acquired, so
+        # concurrent first executions of a session bind a single kernel
+        self._acquiring: Dict[str, list] = {}
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._queued = 0
+        self._refill_task: Optional[asyncio.Task] = None
+
+    def _kernel_count(self) -> int:
+        return len(self._spares) + len(self._sessions) + self._pending
+
+    async def _spawn(self) -> Kernel:
+        self._pending += 1
+        try:
+            return await Kernel.spawn()
+        finally:
+            self._pending -= 1
+
+    async def _refill(self):
+        while len(self._spares) < self.size and self._kernel_count() < self.max_kernels:
+            try:
+                kernel = await self._spawn()
+            except Exception as e:
+                print(f"Failed to pre-spawn Python kernel: {e}")
+                return
+            self._spares.append(kernel)
+
+    def warm(self):
+        """Top up the spare kernels in the background (needs a running event loop)"""
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+
+    async def _evict_idle(self):
+        """Shut down kernels idle longer than the timeout, and LRU ones if over capacity"""
+        now = time.monotonic()
+        evicted = []
+        for session_id, kernel in list(self._sessions.items()):
+            if kernel.busy:
+                continue
+            if not kernel.is_alive() or now - kernel.last_used > self.idle_timeout:
+                evicted.append(self._sessions.pop(session_id))
+        # Taking a spare doesn't grow the pool; otherwise make room for a new worker
+        needed = 0 if self._spares else 1
+        idle = [s for s, k in self._sessions.items() if not k.busy]
+        while idle and self._kernel_count() + needed > self.max_kernels:
+            lru = min(idle, key=lambda s: self._sessions[s].last_used)
+            idle.remove(lru)
+            evicted.append(self._sessions.pop(lru))
+        for kernel in evicted:
+            await kernel.shutdown()
+
+    async def acquire(self, session_id: str, workspace_dir: str) -> Kernel:
+        """Return the session's kernel, binding a warm spare (or a fresh worker) if needed"""
+        kernel = self._sessions.get(session_id)
+        if kernel and kernel.is_alive():
+            return kernel
+
+        entry = self._acquiring.setdefault(session_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                # Another call for the session may have bound a kernel meanwhile
+                kernel = self._sessions.get(session_id)
+                if kernel and kernel.is_alive():
+                    return kernel
+                kernel = await self._bind_new(session_id, workspace_dir)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._acquiring[session_id]
+        self.warm()
+        return kernel
+
+    async def _bind_new(self, session_id: str, workspace_dir: str) -> Kernel:
+        await self._evict_idle()
+        kernel = None
+        while self._spares and kernel is None:
+            candidate = self._spares.pop()
+            if candidate.is_alive():
+                kernel = candidate
+        if kernel is None:
+            kernel = await self._spawn()
+        # Only registered once bound, so nothing else reads its stdout meanwhile
+        self._pending += 1
+        try:
+            await kernel.bind(session_id, workspace_dir)
+        except BaseException:
+            kernel.kill()
+            raise
+        finally:
+            self._pending -= 1
+        self._sessions[session_id] = kernel
+        return kernel
+
+    async def execute(
+        self,
+        session_id: str,
+        workspace_dir: str,
+        code: str,
+        on_output: Optional[OutputCallback] = None,
+        timeout: float = KERNEL_EXEC_TIMEOUT,
+    ) -> Dict[str, Any]:
+        """Queue for a free slot, then run `code` in the session's kernel"""
+        if self._slots.locked() and on_output:
+            await on_output("status", f"Waiting for a free Python kernel ({self._queued + 1} in queue)...\n")
+        self._queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._queued -= 1
+        try:
+            kernel = await self.acquire(session_id, workspace_dir)
+            try:
+                return await kernel.execute(code, on_output=on_output, timeout=timeout)
+            except KernelDied:
+                self.discard(session_id)
+                raise
+        finally:
+            self._slots.release()
+
+    def interrupt(self, session_id: str):
+        """Interrupt the session's running cell, e.g. when the user hits stop"""
+        kernel = self._sessions.get(session_id)
+        if kernel and kernel.busy:
+            kernel.interrupt()
+
+    def discard(self, session_id: str):
+        """Kill a session's kernel, e.g. when it no longer responds"""
+        kernel = self._sessions.pop(session_id, None)
+        if kernel:
+            kernel.kill()
+
+    async def release(self, session_id: str):
+        """Shut down a session's kernel when the chat ends"""
+        kernel = self._sessions.pop(session_id, None)
+        if kernel:
+            await kernel.shutdown()
+
+
+kernel_pool = KernelPool()
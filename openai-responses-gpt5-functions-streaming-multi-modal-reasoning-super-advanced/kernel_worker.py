@@ -0,0 +1,220 @@
+"""
+Worker process for the pooled Python kernels (see kernel.py)
+
+Reads one JSON command per line on stdin and answers with JSON events on
+stdout. The interpreter, its imports and the user namespace stay alive
+between `exec` commands. Output is sent as `stream` events while a cell
+runs, and SIGINT interrupts the running cell.
+"""
+
+import io
+import json
+import os
+import signal
+import sys
+import traceback
+
+import matplotlib
+matplotlib.use('Agg')  # Use non-interactive backend
+import matplotlib.pyplot as plt
+
+# Warm the usual data-analysis imports so the first cell doesn't pay for them
+try:
+    import numpy  # noqa: F401
+    import pandas  # noqa: F401
+except ImportError:
+    pass
+
+# Keep the real stdout for the protocol and silence fd 1 so stray writes from
+# C extensions or child processes can't corrupt it
+_protocol = os.fdopen(os.dup(1), 'w', buffering=1)
+os.dup2(os.open(os.devnull, os.O_WRONLY), 1)
+
+
+def _emit(event):
+    _protocol.write(json.dumps(event) + "\n")
+    _protocol.flush()
+
+
+class _StreamWriter(io.TextIOBase):
+    """File-like object that forwards complete lines as `stream` events"""
+
+    def __init__(self, name):
+        self.name = name
+        self._buffer = ""
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self._buffer += text
+        if "\n" in self._buffer or len(self._buffer) > 4096:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        if self._buffer:
+            _emit({"type": "stream", "name": self.name, "text": self._buffer})
+            self._buffer = ""
+
+
+_in_cell = False
+
+
+def _on_sigint(signum, frame):
+    # Only interrupt user code; a late signal must not kill the idle worker
+    if _in_cell:
+        raise KeyboardInterrupt
+
+
+signal.signal(signal.SIGINT, _on_sigint)
+
+
+class WorkspaceIndex:
+    """
+    Remembers a (mtime, size, inode) signature for every file in the workspace
+
+    `scan()` stats the directory and returns only the files that are new or
+    whose signature changed since the previous scan, so post-processing and
+    file reporting never touch files the cell didn't write.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.entries = {}
+
+    def _snapshot(self):
+        snapshot = {}
+        with os.scandir(self.root) as it:
+            for entry in it:
+                try:
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                snapshot[entry.name] = (st.st_mtime_ns, st.st_size, st.st_ino)
+        return snapshot
+
+    def scan(self):
+        snapshot = self._snapshot()
+        changed = [name for name, sig in snapshot.items() if self.entries.get(name) != sig]
+        self.entries = snapshot
+        return sorted(changed)
+
+    def refresh(self, name):
+        """Re-record one file after we rewrote it ourselves"""
+        try:
+            st = os.stat(os.path.join(self.root, name))
+        except OSError:
+            self.entries.pop(name, None)
+            return
+        self.entries[name] = (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+_index = None
+
+
+def _post_process():
+    # Save any matplotlib figures
+    if plt.get_fignums():
+        for i, fig_num in enumerate(plt.get_fignums()):
+            fig = plt.figure(fig_num)
+            filename = f'figure_{i+1}.png'
+            fig.savefig(filename, dpi=150, bbox_inches='tight')
+            print(f"Saved figure: {filename}")
+        plt.close('all')
+
+    changed_files = _index.scan()
+
+    # Post-process new or modified CSV files to ensure they have proper headers
+    for csv_file in [f for f in changed_files if f.endswith('.csv')]:
+        try:
+            import pandas as pd
+            # Try to read the CSV
+            df = pd.read_csv(csv_file, header=None)
+            # If it has no headers and looks like numeric data, add generic headers
+            if len(df.columns) > 1 and df.dtypes.apply(lambda x: x.name in ['float64', 'int64']).all():
+                # Add column headers for better display
+                df.columns = [f'col_{i}' for i in range(len(df.columns))]
+                # Save back with headers
+                df.to_csv(csv_file, index=False)
+                _index.refresh(csv_file)
+                print(f"Added headers to {csv_file}")
+        except Exception:
+            # If pandas processing fails, leave the CSV as is
+            pass
+
+    if changed_files:
+        print(f"Generated files: {changed_files}")
+    return changed_files
+
+
+def _run(code, namespace):
+    global _in_cell
+    stdout, stderr = _StreamWriter("stdout"), _StreamWriter("stderr")
+    sys.stdout, sys.stderr = stdout, stderr
+    return_code = 0
+    changed_files = []
+    try:
+        # A previous cell may have changed directory
+        os.chdir(_index.root)
+        # Pick up files added outside the kernel (e.g. uploads) so they aren't reported as generated
+        _index.scan()
+
+        # Show existing files at start
+        existing_files = sorted(f for f in _index.entries if not f.endswith('.py'))
+        if existing_files:
+            print(f"Existing files in workspace: {existing_files}")
+
+        try:
+            _in_cell = True
+            exec(compile(code, "<cell>", "exec"), namespace)
+        except SystemExit as e:
+            return_code = e.code if isinstance(e.code, int) else 1
+        except KeyboardInterrupt:
+            print("Execution interrupted", file=sys.stderr)
+            return_code = 130
+        except BaseException:
+            traceback.print_exc()
+            return_code = 1
+        finally:
+            _in_cell = False
+
+        os.chdir(_index.root)
+        changed_files = _post_process()
+    except BaseException:
+        traceback.print_exc()
+        return_code = return_code or 1
+    finally:
+        stdout.flush()
+        stderr.flush()
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    return return_code, changed_files
+
+
+def main():
+    global _index
+    # Modules pre-imported for user code
+    namespace = {"__name__": "__main__", "os": os, "sys": sys, "matplotlib": matplotlib, "plt": plt}
+    _emit({"type": "ready"})
+    for line in sys.stdin:
+        try:
+            command = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        op = command.get("op")
+        if op == "init":
+            os.chdir(command["cwd"])
+            _index = WorkspaceIndex(os.getcwd())
+            _index.scan()
+            _emit({"type": "init_done"})
+        elif op == "exec":
+            return_code, changed_files = _run(command.get("code", ""), namespace)
+            _emit({"type": "done", "return_code": return_code, "generated_files": changed_files})
+        elif op == "shutdown":
+            break
+
+
+if __name__ == "__main__":
+    main()
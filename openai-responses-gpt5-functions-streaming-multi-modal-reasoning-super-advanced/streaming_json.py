@@ -0,0 +1,111 @@
+"""
+Incremental decoding of one string field from streamed JSON function arguments
+
+The Responses API streams tool arguments as raw JSON fragments. To live-render
+`execute_python_code`, we only need the decoded value of its "code" field,
+and only the part that is new since the previous fragment.
+"""
+
+import re
+from typing import Optional
+
+
+_SPECIAL = re.compile(r'["\\]')
+_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+class JsonStringFieldDecoder:
+    """
+    Resumable decoder for the value of `field` in a streamed JSON object
+
+    Each `feed(fragment)` returns only the characters decoded from that
+    fragment, so the total work is linear in the argument length. Escape
+    sequences split across fragments (including surrogate pairs) are held
+    back until they are complete.
+    """
+
+    def __init__(self, field: str = "code"):
+        self._key = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._buffer = ""  # undecoded text: the prefix before the value, then any partial escape
+        self._in_value = False
+        self.done = False
+
+    def feed(self, fragment: str) -> str:
+        if self.done:
+            return ""
+        self._buffer += fragment
+        if not self._in_value:
+            match = self._key.search(self._buffer)
+            if not match:
+                return ""
+            self._buffer = self._buffer[match.end():]
+            self._in_value = True
+        return self._decode()
+
+    def _decode(self) -> str:
+        text = self._buffer
+        out = []
+        i = 0
+        n = len(text)
+        while i < n:
+            # Copy plain runs in one slice
+            match = _SPECIAL.search(text, i)
+            j = match.start() if match else n
+            if j > i:
+                out.append(text[i:j])
+                i = j
+            if i >= n:
+                break
+            if text[i] == '"':
+                self.done = True
+                i = n
+                break
+            # Backslash escape
+            if i + 1 >= n:
+                break
+            code = text[i + 1]
+            if code != "u":
+                out.append(_ESCAPES.get(code, code))
+                i += 2
+                continue
+            char = self._decode_unicode(text, i)
+            if char is None:
+                break
+            out.append(char[0])
+            i += char[1]
+        self._buffer = text[i:]
+        return "".join(out)
+
+    @staticmethod
+    def _decode_unicode(text: str, i: int) -> Optional[tuple]:
+        """Decode a \\uXXXX escape at `i`, returning (char, consumed) or None if incomplete"""
+        if i + 6 > len(text):
+            return None
+        try:
+            high = int(text[i + 2:i + 6], 16)
+        except ValueError:
+            return (text[i:i + 6], 6)
+        if 0xD800 <= high <= 0xDBFF:
+            # Surrogate pair: wait for the low half
+            if i + 12 > len(text):
+                return None
+            if text[i + 6:i + 8] == "\\u":
+                try:
+                    low = int(text[i + 8:i + 12], 16)
+                except ValueError:
+                    low = 0
+                if 0xDC00 <= low <= 0xDFFF:
+                    return (chr(0x10000 + ((high - 0xD800) << 10) + (low - 0xDC00)), 12)
+            return ("\ufffd", 6)
+        if 0xDC00 <= high <= 0xDFFF:
+            return ("\ufffd", 6)
+        return (chr(high), 6)
@@ -4,8 +4,6 @@ Includes local Python executor and other utility functions
 """
 
 import json
-import subprocess
-import sys
 import tempfile
 import os
 import pathlib
@@ -13,6 +11,8 @@ import base64
 from typing import List, Dict, Any, Optional, Tuple
 import chainlit as cl
 
+from kernel import kernel_pool, KernelTimeout, OutputCallback, KERNEL_EXEC_TIMEOUT
+
 
 class LocalPythonExecutor:
     """Execute Python code locally and return results with file attachments"""
@@ -26,122 +26,58 @@ class LocalPythonExecutor:
             session_id = cl.user_session.get("id") or "default"
             ws = os.path.join(os.getcwd(), ".files", session_id, "pyws")
         self.workspace_dir = ws
+        self.session_id = cl.user_session.get("id") or "default"
         os.makedirs(self.workspace_dir, exist_ok=True)
         self.output_files = []
     
-    def execute_code(self, code: str) -> Dict[str, Any]:
+    async def execute_code(self, code: str, on_output: Optional[OutputCallback] = None) -> Dict[str, Any]:
         """
-        Execute Python code locally and capture output, errors, and generated files
+        Execute Python code in the session's warm kernel and capture output, errors, and generated files
         
         Args:
             code: Python code to execute
+            on_output: Optional async callback receiving (stream_name, text) while the code runs
             
         Returns:
             Dict containing stdout, stderr, return_code, and generated files
         """
-        # Create a temporary Python file in the workspace
-        temp_file = tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False, dir=self.workspace_dir)
-        
-        # Track files before execution (in the persistent workspace)
-        initial_files = set(os.listdir(self.workspace_dir))
-        
-        # Modify the code to work in the persistent workspace and list existing files
-        enhanced_code = f"""
-import sys
-import os
-import matplotlib
-matplotlib.use('Agg')  # Use non-interactive backend
-import matplotlib.pyplot as plt
-
-# Change to workspace directory (using raw string to handle Windows paths)
-os.chdir(r'{self.workspace_dir}')
-
-# Show existing files at start
-existing_files = [f for f in os.listdir('.') if not f.endswith('.py')]
-if existing_files:
-    print(f"Existing files in workspace: {{existing_files}}")
-
-# Track files before execution
-_initial_files = set(os.listdir('.'))
-
-# Original code
-{code}
-
-# Save any matplotlib figures
-if plt.get_fignums():
-    for i, fig_num in enumerate(plt.get_fignums()):
-        fig = plt.figure(fig_num)
-        filename = f'figure_{{i+1}}.png'
-        fig.savefig(filename, dpi=150, bbox_inches='tight')
-        print(f"Saved figure: {{filename}}")
-
-# Post-process CSV files to ensure they have proper headers
-import glob
-for csv_file in glob.glob('*.csv'):
-    try:
-        import pandas as pd
-        # Try to read the CSV
-        df = pd.read_csv(csv_file, header=None)
-        # If it has no headers and looks like numeric data, add generic headers
-        if len(df.columns) > 1 and df.dtypes.apply(lambda x: x.name in ['float64', 'int64']).all():
-            # Add column headers for better display
-            df.columns = [f'col_{{i}}' for i in range(len(df.columns))]
-            # Save back with headers
-            df.to_csv(csv_file, index=False)
-            print(f"Added headers to {{csv_file}}")
-    except Exception as e:
-        # If pandas processing fails, leave the CSV as is
-        pass
-
-# Track new files created
-_final_files = set(os.listdir('.'))
-_new_files = _final_files - _initial_files
-if _new_files:
-    print(f"Generated files: {{list(_new_files)}}")
-"""
-        
-        temp_file.write(enhanced_code)
-        temp_file.close()
-        
         try:
-            # Execute the code in the persistent workspace
-            result = subprocess.run(
-                [sys.executable, temp_file.name],
-                capture_output=True,
-                text=True,
-                cwd=self.workspace_dir,
-                timeout=30  # 30 second timeout
+            result = await kernel_pool.execute(
+                self.session_id, self.workspace_dir, code, on_output=on_output, timeout=KERNEL_EXEC_TIMEOUT
             )
             
-            # Find newly generated files
-            final_files = set(os.listdir(self.workspace_dir))
-            new_files = final_files - initial_files - {os.path.basename(temp_file.name)}
-            
+            # The kernel's workspace index reports only files the code created or modified
             generated_files = []
-            for file in new_files:
+            for file in result['generated_files']:
                 file_path = os.path.join(self.workspace_dir, file)
                 if os.path.isfile(file_path):
                     generated_files.append(file_path)
             
             return {
-                'stdout': result.stdout,
-                'stderr': result.stderr,
-                'return_code': result.returncode,
+                'stdout': result['stdout'],
+                'stderr': result['stderr'],
+                'return_code': result['return_code'],
                 'generated_files': generated_files,
-                'success': result.returncode == 0,
+                'success': result['return_code'] == 0,
                 'workspace_dir': self.workspace_dir
             }
             
-        except subprocess.TimeoutExpired:
+        except KernelTimeout as e:
+            # The cell was interrupted; the kernel and its variables survive.
+            # Keep what it printed so far, the user already saw it streamed.
+            stderr = e.stderr
+            if stderr and not stderr.endswith('\n'):
+                stderr += '\n'
             return {
-                'stdout': '',
-                'stderr': 'Code execution timed out after 30 seconds',
+                'stdout': e.stdout,
+                'stderr': stderr + f'Code execution timed out after {KERNEL_EXEC_TIMEOUT:g} seconds',
                 'return_code': -1,
                 'generated_files': [],
                 'success': False,
                 'workspace_dir': self.workspace_dir
             }
         except Exception as e:
+            kernel_pool.discard(self.session_id)
             return {
                 'stdout': '',
                 'stderr': f'Execution error: {str(e)}',
@@ -150,16 +86,9 @@ if _new_files:
                 'success': False,
                 'workspace_dir': self.workspace_dir
             }
-        finally:
-            # Clean up temp Python file but keep generated files
-            try:
-                os.unlink(temp_file.name)
-            except:
-                pass
     
     def cleanup(self):
-        """Clean up - but now this just removes temp files, not the workspace"""
-        # Don't remove the workspace directory - let files persist
+        """Nothing to clean up - the workspace and the session's kernel persist"""
         pass
 
 
@@ -279,12 +208,13 @@ def upload_file_to_workspace(filename: str, content: bytes) -> str:
         return json.dumps(result)
 
 
-def execute_python_code(code: str) -> Tuple[str, List[Dict[str, Any]]]:
+async def execute_python_code(code: str, on_output: Optional[OutputCallback] = None) -> Tuple[str, List[Dict[str, Any]]]:
     """
     Execute Python code locally and return formatted results
     
     Args:
         code: Python code to execute
+        on_output: Optional async callback receiving (stream_name, text) while the code runs
         
     Returns:
         Tuple of (conversation_result_json, files_for_display)
@@ -292,7 +222,7 @@ def execute_python_code(code: str) -> Tuple[str, List[Dict[str, Any]]]:
     executor = LocalPythonExecutor()
     
     try:
-        result = executor.execute_code(code)
+        result = await executor.execute_code(code, on_output=on_output)
         
         # Process files BEFORE cleanup
         processed_files = []
@@ -506,8 +436,14 @@ async def call_function_tool(call: Dict[str, Any], full_history: List[Dict[str,
     elif call["name"] == "execute_python_code":
         code = args.get("code", "")
         
-        # Execute the code and get both conversation result and files
-        conversation_result, processed_files = execute_python_code(code)
+        # Execute the code, streaming its output live, and get both conversation result and files
+        async with cl.Step(name="Python Output", type="tool") as output_step:
+            output_step.language = "text"
+
+            async def stream_output(name: str, text: str):
+                await output_step.stream_token(text)
+
+            conversation_result, processed_files = await execute_python_code(code, on_output=stream_output)
         out = conversation_result
         
         # Display execution results and files
@@ -1,13 +1,18 @@
 import os
 import io
+import re
+import time
 import wave
+import asyncio
 import httpx
-import numpy as np
-import audioop
+from typing import AsyncIterator, List, Optional, Tuple
+from uuid import uuid4
 
 from openai import AsyncOpenAI
 import chainlit as cl
 
+from vad import SAMPLE_RATE, StreamingVAD
+
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
 ELEVENLABS_VOICE_ID = os.getenv("ELEVENLABS_VOICE_ID")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -20,11 +25,50 @@ if not ELEVENLABS_API_KEY or not ELEVENLABS_VOICE_ID or not OPENAI_API_KEY:
     )
 
 
-# Define a threshold for detecting silence and a timeout for ending a turn
-SILENCE_THRESHOLD = (
-    3500  # Adjust based on your audio level (e.g., lower for quieter audio)
-)
-SILENCE_TIMEOUT = 1300.0  # Seconds of silence to consider the turn finished
+# Turns shorter than this are ignored (voice detection settings are in vad.py)
+MIN_TURN_SECONDS = 1.71
+
+TTS_CONCURRENCY = 3  # Sentences synthesized ahead of the one playing
+MIN_SENTENCE_CHARS = 40  # Shorter sentences are merged with the next one
+SENTENCE_END = re.compile(r"(?<=[.!?…])[\"')\]]*\s+")
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Shared client so TTS requests reuse warm connections"""
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=25.0,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=TTS_CONCURRENCY),
+        )
+    return _http_client
+
+
+class TurnTimer:
+    """Per-turn latency marks, measured from the end of the user's speech"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks = {}
+
+    def mark(self, name: str):
+        self.marks.setdefault(name, time.perf_counter() - self.start)
+
+    def report(self) -> str:
+        return ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.marks.items())
+
+
+def split_sentences(text: str) -> Tuple[List[str], str]:
+    """Cut complete sentences off `text`, returning them and the unfinished rest"""
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        if match.end() - start >= MIN_SENTENCE_CHARS:
+            sentences.append(text[start:match.end()].strip())
+            start = match.end()
+    return sentences, text[start:]
 
 
 @cl.step(type="tool")
@@ -36,14 +80,11 @@ async def speech_to_text(audio_file):
     return response.text
 
 
-@cl.step(type="tool")
-async def text_to_speech(text: str, mime_type: str):
-    CHUNK_SIZE = 1024
-
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{ELEVENLABS_VOICE_ID}"
+async def text_to_speech(text: str) -> AsyncIterator[bytes]:
+    """Stream 24kHz 16-bit PCM for `text` as ElevenLabs produces it"""
+    url = f"https://api.elevenlabs.io/v1/text-to-speech/{ELEVENLABS_VOICE_ID}/stream"
 
     headers = {
-        "Accept": mime_type,
         "Content-Type": "application/json",
         "xi-api-key": ELEVENLABS_API_KEY,
     }
@@ -54,35 +95,109 @@ async def text_to_speech(text: str, mime_type: str):
         "voice_settings": {"stability": 0.5, "similarity_boost": 0.5},
     }
 
-    async with httpx.AsyncClient(timeout=25.0) as client:
-        response = await client.post(url, json=data, headers=headers)
+    async with get_http_client().stream(
+        "POST", url, json=data, headers=headers,
+        params={"output_format": f"pcm_{SAMPLE_RATE}"},
+    ) as response:
         response.raise_for_status()  # Ensure we notice bad responses
 
-        buffer = io.BytesIO()
-        buffer.name = f"output_audio.{mime_type.split('/')[1]}"
+        # Only forward whole 16-bit samples
+        pending = b""
+        async for chunk in response.aiter_bytes():
+            chunk = pending + chunk
+            usable = len(chunk) - len(chunk) % 2
+            pending = chunk[usable:]
+            if usable:
+                yield chunk[:usable]
 
-        async for chunk in response.aiter_bytes(chunk_size=CHUNK_SIZE):
-            if chunk:
-                buffer.write(chunk)
 
-        buffer.seek(0)
-        return buffer.name, buffer.read()
-
-
-@cl.step(type="tool")
-async def generate_text_answer(transcription):
+async def stream_text_answer(transcription: str) -> AsyncIterator[str]:
     message_history = cl.user_session.get("message_history")
 
     message_history.append({"role": "user", "content": transcription})
 
-    response = await openai_client.chat.completions.create(
-        model="gpt-4o", messages=message_history, temperature=0.2
+    stream = await openai_client.chat.completions.create(
+        model="gpt-4o", messages=message_history, temperature=0.2, stream=True
     )
 
-    message = response.choices[0].message
-    message_history.append(message)
-
-    return message.content
+    answer = []
+    async for chunk in stream:
+        if chunk.choices and (token := chunk.choices[0].delta.content):
+            answer.append(token)
+            yield token
+
+    message_history.append({"role": "assistant", "content": "".join(answer)})
+
+
+async def speak_answer(transcription: str, timer: TurnTimer) -> cl.Message:
+    """
+    Stream the answer and speak it sentence by sentence
+
+    Each finished sentence is sent to TTS right away (a few at a time), and
+    audio is played in sentence order as soon as it arrives, so speech starts
+    after the first sentence instead of after the whole answer.
+    """
+    answer_msg = cl.Message(content="")
+    track_id = str(uuid4())
+    slots = asyncio.Semaphore(TTS_CONCURRENCY)
+    queues: asyncio.Queue = asyncio.Queue()  # one chunk queue per sentence, in order
+    tasks = []
+    pcm = bytearray()
+
+    async def synthesize(sentence: str, chunks: asyncio.Queue):
+        try:
+            async with slots:
+                async for audio in text_to_speech(sentence):
+                    await chunks.put(audio)
+        finally:
+            await chunks.put(None)
+
+    def start_sentence(sentence: str):
+        timer.mark("first_sentence")
+        chunks: asyncio.Queue = asyncio.Queue()
+        tasks.append(asyncio.create_task(synthesize(sentence, chunks)))
+        queues.put_nowait(chunks)
+
+    async def play():
+        while (chunks := await queues.get()) is not None:
+            while (audio := await chunks.get()) is not None:
+                timer.mark("first_audio")
+                pcm.extend(audio)
+                await cl.context.emitter.send_audio_chunk(
+                    cl.OutputAudioChunk(mimeType="pcm16", data=audio, track=track_id)
+                )
+
+    player = asyncio.create_task(play())
+    try:
+        buffer = ""
+        async for token in stream_text_answer(transcription):
+            timer.mark("first_token")
+            await answer_msg.stream_token(token)
+            buffer += token
+            sentences, buffer = split_sentences(buffer)
+            for sentence in sentences:
+                start_sentence(sentence)
+        if buffer.strip():
+            start_sentence(buffer.strip())
+        queues.put_nowait(None)
+
+        await player
+        # Surface TTS errors
+        await asyncio.gather(*tasks)
+    finally:
+        for task in [player, *tasks]:
+            task.cancel()
+
+    # Keep the spoken answer for replay
+    wav_buffer = io.BytesIO()
+    with wave.open(wav_buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(SAMPLE_RATE)
+        wav_file.writeframes(pcm)
+    answer_msg.elements = [cl.Audio(mime="audio/wav", content=wav_buffer.getvalue())]
+    await answer_msg.send()
+    return answer_msg
 
 
 @cl.on_chat_start
@@ -95,80 +210,38 @@ async def start():
 
 @cl.on_audio_start
 async def on_audio_start():
-    cl.user_session.set("silent_duration_ms", 0)
-    cl.user_session.set("is_speaking", False)
-    cl.user_session.set("audio_chunks", [])
+    cl.user_session.set("vad", StreamingVAD())
     return True
 
 
 @cl.on_audio_chunk
 async def on_audio_chunk(chunk: cl.InputAudioChunk):
-    audio_chunks = cl.user_session.get("audio_chunks")
+    vad = cl.user_session.get("vad")
+    if vad is None:
+        return
 
-    if audio_chunks is not None:
-        audio_chunk = np.frombuffer(chunk.data, dtype=np.int16)
-        audio_chunks.append(audio_chunk)
+    # The detector appends the chunk and ends the turn after enough silence
+    if vad.feed(chunk.data):
+        await process_audio(vad)
 
-    # If this is the first chunk, initialize timers and state
-    if chunk.isStart:
-        cl.user_session.set("last_elapsed_time", chunk.elapsedTime)
-        cl.user_session.set("is_speaking", True)
-        return
 
-    audio_chunks = cl.user_session.get("audio_chunks")
-    last_elapsed_time = cl.user_session.get("last_elapsed_time")
-    silent_duration_ms = cl.user_session.get("silent_duration_ms")
-    is_speaking = cl.user_session.get("is_speaking")
-
-    # Calculate the time difference between this chunk and the previous one
-    time_diff_ms = chunk.elapsedTime - last_elapsed_time
-    cl.user_session.set("last_elapsed_time", chunk.elapsedTime)
-
-    # Compute the RMS (root mean square) energy of the audio chunk
-    audio_energy = audioop.rms(
-        chunk.data, 2
-    )  # Assumes 16-bit audio (2 bytes per sample)
-
-    if audio_energy < SILENCE_THRESHOLD:
-        # Audio is considered silent
-        silent_duration_ms += time_diff_ms
-        cl.user_session.set("silent_duration_ms", silent_duration_ms)
-        if silent_duration_ms >= SILENCE_TIMEOUT and is_speaking:
-            cl.user_session.set("is_speaking", False)
-            await process_audio()
-    else:
-        # Audio is not silent, reset silence timer and mark as speaking
-        cl.user_session.set("silent_duration_ms", 0)
-        if not is_speaking:
-            cl.user_session.set("is_speaking", True)
-
-
-async def process_audio():
-    # Get the audio buffer from the session
-    if audio_chunks := cl.user_session.get("audio_chunks"):
-        # Concatenate all chunks
-        concatenated = np.concatenate(list(audio_chunks))
-
-        # Create an in-memory binary stream
-        wav_buffer = io.BytesIO()
-
-        # Create WAV file with proper parameters
-        with wave.open(wav_buffer, "wb") as wav_file:
-            wav_file.setnchannels(1)  # mono
-            wav_file.setsampwidth(2)  # 2 bytes per sample (16-bit)
-            wav_file.setframerate(24000)  # sample rate (24kHz PCM)
-            wav_file.writeframes(concatenated.tobytes())
-
-        # Reset buffer position
-        wav_buffer.seek(0)
-
-        cl.user_session.set("audio_chunks", [])
-
-    frames = wav_file.getnframes()
-    rate = wav_file.getframerate()
-
-    duration = frames / float(rate)
-    if duration <= 1.71:
+async def process_audio(vad: StreamingVAD):
+    timer = TurnTimer()
+    duration = vad.duration
+    audio = vad.audio()
+
+    # Create an in-memory WAV file straight from the turn's samples
+    wav_buffer = io.BytesIO()
+    with wave.open(wav_buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)  # mono
+        wav_file.setsampwidth(2)  # 2 bytes per sample (16-bit)
+        wav_file.setframerate(SAMPLE_RATE)  # sample rate (24kHz PCM)
+        wav_file.writeframes(audio)
+
+    # Start listening for the next turn
+    vad.reset()
+
+    if duration <= MIN_TURN_SECONDS:
         print("The audio is too short, please try again.")
         return
 
@@ -186,17 +259,9 @@ async def process_audio():
         elements=[input_audio_el],
     ).send()
 
-    answer = await generate_text_answer(transcription)
-
-    output_name, output_audio = await text_to_speech(answer, "audio/wav")
-
-    output_audio_el = cl.Audio(
-        auto_play=True,
-        mime="audio/wav",
-        content=output_audio,
-    )
-
-    await cl.Message(content=answer, elements=[output_audio_el]).send()
+    timer.mark("transcribed")
+    await speak_answer(transcription, timer)
+    print(f"Turn latency: {timer.report()}")
 
 
 @cl.on_message
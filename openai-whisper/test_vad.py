@@ -0,0 +1,81 @@
+import wave
+
+import numpy as np
+
+from vad import HANGOVER_MS, SAMPLE_RATE, SILENCE_TIMEOUT_MS, StreamingVAD, _read_wav, replay
+
+# A turn ends this long after its speech stops
+END_DELAY = (HANGOVER_MS + SILENCE_TIMEOUT_MS) / 1000
+
+
+def _noise(rng, seconds, std=100.0):
+    return rng.normal(0, std, int(seconds * SAMPLE_RATE))
+
+
+def _speech(rng, seconds, amplitude=4000.0):
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    return amplitude * np.sin(2 * np.pi * 220 * t) + _noise(rng, seconds)
+
+
+def _write_wav(path, parts):
+    samples = np.concatenate(parts).astype(np.int16)
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(samples.tobytes())
+    return path
+
+
+def _replay_wav(path):
+    samples, rate = _read_wav(str(path))
+    return replay(StreamingVAD(sample_rate=rate), samples)
+
+
+def _assert_turns(turns, expected_ends, tolerance=0.3):
+    assert len(turns) == len(expected_ends)
+    for (_, end), expected in zip(turns, expected_ends):
+        assert abs(end - expected) <= tolerance
+
+
+def test_speaking_immediately_ends_each_turn(tmp_path):
+    rng = np.random.default_rng(0)
+    path = _write_wav(tmp_path / "immediate.wav", [
+        _speech(rng, 2), _noise(rng, 2), _speech(rng, 1.5), _noise(rng, 2),
+    ])
+    _assert_turns(_replay_wav(path), [2 + END_DELAY, 5.5 + END_DELAY])
+
+
+def test_turns_after_initial_silence(tmp_path):
+    rng = np.random.default_rng(1)
+    path = _write_wav(tmp_path / "pause.wav", [
+        _noise(rng, 1), _speech(rng, 1), _noise(rng, 2), _speech(rng, 1), _noise(rng, 2),
+    ])
+    _assert_turns(_replay_wav(path), [2 + END_DELAY, 5 + END_DELAY])
+
+
+def test_steady_background_noise_is_not_speech(tmp_path):
+    rng = np.random.default_rng(2)
+    path = _write_wav(tmp_path / "noise.wav", [_noise(rng, 5, std=400.0)])
+    assert _replay_wav(path) == []
+
+
+def test_soft_word_ending_is_covered_by_the_hangover(tmp_path):
+    rng = np.random.default_rng(3)
+    # The soft ending is below the speech threshold, and the pause after it
+    # is just short enough to stay inside the hangover plus the timeout
+    pause = (HANGOVER_MS + SILENCE_TIMEOUT_MS) / 1000 - 0.3
+    first_word = [_noise(rng, 0.5), _speech(rng, 1), _speech(rng, 0.25, amplitude=500.0)]
+    rest = [_noise(rng, pause), _speech(rng, 1), _noise(rng, 2)]
+    path = _write_wav(tmp_path / "soft_ending.wav", first_word + rest)
+    samples, rate = _read_wav(str(path))
+
+    vad = StreamingVAD(sample_rate=rate)
+    split = sum(len(part) for part in first_word)
+    assert not vad.feed(samples[:split].tobytes())
+    # The speech tail is not noise, so it must not raise the floor
+    assert vad.noise_floor < 150
+
+    vad = StreamingVAD(sample_rate=rate)
+    end = 0.5 + 1 + 0.25 + pause + 1
+    _assert_turns(replay(vad, samples), [end + END_DELAY])
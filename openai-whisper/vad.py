@@ -0,0 +1,166 @@
+"""
+Streaming voice-activity detection and end-of-turn detection for the voice demo
+
+Audio arrives as 16-bit mono PCM chunks of arbitrary size. It is cut into
+fixed frames whose RMS energy is compared with an adaptive noise floor, so
+the detector works for quiet and loud microphones alike. A short hangover
+keeps soft word endings and brief dips classed as speech, and a turn ends
+after a further `silence_timeout_ms` of silence. All timing uses the
+number of samples received, not client timestamps.
+
+Replay a recording to tune the settings:
+
+    python vad.py recording.wav [--chunk-ms 100]
+"""
+
+import argparse
+import wave
+from typing import List, Tuple
+
+import numpy as np
+
+
+SAMPLE_RATE = 24000  # Chainlit sends 24kHz PCM
+FRAME_MS = 20
+HANGOVER_MS = 300  # Frames after speech still classed as speech (soft endings, dips)
+SILENCE_TIMEOUT_MS = 1000  # Silence after the hangover that ends the turn (1.3s in total)
+SPEECH_RATIO = 3.0  # Frame energy above floor * ratio counts as speech (~10 dB)
+MIN_SPEECH_RMS = 500.0  # Never treat frames quieter than this as speech
+NOISE_FLOOR_INIT = 300.0
+CALIBRATION_MS = 200  # Quiet frames (below MIN_SPEECH_RMS) averaged into the initial noise floor
+NOISE_ADAPT = 0.05  # How fast the noise floor follows non-speech frames
+INITIAL_CAPACITY_S = 30  # Preallocated audio; grows by doubling if a turn is longer
+
+
+class StreamingVAD:
+    """All per-session voice state: the turn's audio and the detector"""
+
+    def __init__(
+        self,
+        sample_rate: int = SAMPLE_RATE,
+        frame_ms: int = FRAME_MS,
+        silence_timeout_ms: int = SILENCE_TIMEOUT_MS,
+        hangover_ms: int = HANGOVER_MS,
+        speech_ratio: float = SPEECH_RATIO,
+        min_speech_rms: float = MIN_SPEECH_RMS,
+    ):
+        self.sample_rate = sample_rate
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.silence_timeout_frames = silence_timeout_ms // frame_ms
+        self.hangover_frames = hangover_ms // frame_ms
+        self.speech_ratio = speech_ratio
+        self.min_speech_rms = min_speech_rms
+        self.noise_floor = NOISE_FLOOR_INIT
+        self.calibration_frames = CALIBRATION_MS // frame_ms
+        self._calibrated = 0
+
+        self._audio = np.empty(sample_rate * INITIAL_CAPACITY_S, dtype=np.int16)
+        self.reset()
+
+    def reset(self):
+        """Start a new turn, keeping the buffer and the learned noise floor"""
+        self._length = 0
+        self._analyzed = 0  # samples already split into frames
+        self.speech_frames = 0
+        self.silent_frames = 0
+        self.hangover_left = 0
+        self.ended = False
+
+    @property
+    def duration(self) -> float:
+        return self._length / self.sample_rate
+
+    def audio(self) -> np.ndarray:
+        """The current turn's samples (a view, valid until the next reset or feed)"""
+        return self._audio[:self._length]
+
+    def _append(self, samples: np.ndarray):
+        end = self._length + len(samples)
+        if end > len(self._audio):
+            grown = np.empty(max(end, 2 * len(self._audio)), dtype=np.int16)
+            grown[:self._length] = self._audio[:self._length]
+            self._audio = grown
+        self._audio[self._length:end] = samples
+        self._length = end
+
+    def _frame_energies(self) -> np.ndarray:
+        count = (self._length - self._analyzed) // self.frame_samples
+        if count <= 0:
+            return np.empty(0, dtype=np.float32)
+        end = self._analyzed + count * self.frame_samples
+        frames = self._audio[self._analyzed:end].reshape(count, self.frame_samples).astype(np.float32)
+        self._analyzed = end
+        return np.sqrt(np.mean(frames * frames, axis=1))
+
+    def feed(self, pcm: bytes) -> bool:
+        """Add a chunk; returns True once, when the turn has ended"""
+        self._append(np.frombuffer(pcm, dtype=np.int16))
+        if self.ended:
+            return False
+
+        for energy in self._frame_energies():
+            # Frames loud enough to be speech never calibrate the floor, so
+            # talking right away can't push the threshold above the voice
+            if self._calibrated < self.calibration_frames and energy < self.min_speech_rms:
+                self._calibrated += 1
+                self.noise_floor += (energy - self.noise_floor) / self._calibrated
+                continue
+
+            threshold = max(self.noise_floor * self.speech_ratio, self.min_speech_rms)
+            if energy >= threshold:
+                self.speech_frames += 1
+                self.silent_frames = 0
+                self.hangover_left = self.hangover_frames
+                continue
+            if self.hangover_left:
+                # Still the tail of speech: neither silence nor noise
+                self.hangover_left -= 1
+                continue
+
+            # Only non-speech frames move the floor, so speech can't raise it
+            self.noise_floor += NOISE_ADAPT * (energy - self.noise_floor)
+            self.silent_frames += 1
+            if self.speech_frames and self.silent_frames >= self.silence_timeout_frames:
+                self.ended = True
+                return True
+        return False
+
+
+def replay(vad: StreamingVAD, samples: np.ndarray, chunk_ms: int = 100) -> List[Tuple[float, float]]:
+    """Feed a recording in client-sized chunks and return (start, end) seconds of each detected turn"""
+    chunk = vad.sample_rate * chunk_ms // 1000
+    turns = []
+    start = 0
+    for offset in range(0, len(samples), chunk):
+        if vad.feed(samples[offset:offset + chunk].tobytes()):
+            end = offset + min(chunk, len(samples) - offset)
+            turns.append((start / vad.sample_rate, end / vad.sample_rate))
+            start = end
+            vad.reset()
+    return turns
+
+
+def _read_wav(path: str) -> Tuple[np.ndarray, int]:
+    with wave.open(path, "rb") as f:
+        if f.getsampwidth() != 2 or f.getnchannels() != 1:
+            raise ValueError("Expected 16-bit mono PCM")
+        return np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16), f.getframerate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a 16-bit mono recording through the VAD")
+    parser.add_argument("path", help="WAV file, or raw PCM with --raw")
+    parser.add_argument("--raw", action="store_true", help="Input is raw 16-bit PCM")
+    parser.add_argument("--rate", type=int, default=SAMPLE_RATE)
+    parser.add_argument("--chunk-ms", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.raw:
+        with open(args.path, "rb") as f:
+            samples, rate = np.frombuffer(f.read(), dtype=np.int16), args.rate
+    else:
+        samples, rate = _read_wav(args.path)
+    vad = StreamingVAD(sample_rate=rate)
+    for start, end in replay(vad, samples, args.chunk_ms):
+        print(f"turn {start:7.2f}s - {end:7.2f}s")
+    print(f"noise floor {vad.noise_floor:.0f}")
@@ -1,5 +1,10 @@
+import hashlib
 import os
-from typing import List
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
 from langchain.document_loaders import PyPDFLoader, TextLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.embeddings.openai import OpenAIEmbeddings
@@ -23,7 +28,99 @@ index_name = "langchain-demo"
 text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
 embeddings = OpenAIEmbeddings()
 
-namespaces = set()
+# Content hash -> namespace registry, shared by every session and kept across restarts
+NAMESPACE_REGISTRY_PATH = os.environ.get("NAMESPACE_REGISTRY_PATH", "./namespaces.sqlite")
+
+
+class NamespaceRegistry:
+    """
+    Maps the content hash of an uploaded file to the Pinecone namespace
+    holding its chunks, so the same document uploaded again (by any user,
+    after any restart) is never split or embedded twice
+    """
+
+    def __init__(self, path: str = NAMESPACE_REGISTRY_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS namespaces (sha256 TEXT PRIMARY KEY, "
+            "namespace TEXT, chunk_count INTEGER, file_name TEXT, created_at REAL)"
+        )
+        self.lock = threading.Lock()
+        # hash -> [lock, users], only while an upload of that file is in flight,
+        # so concurrent uploads of a new file embed it once
+        self._file_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sha256: str) -> Optional[Tuple[str, int]]:
+        """The namespace and chunk count of a fully ingested file"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT namespace, chunk_count FROM namespaces "
+                "WHERE sha256 = ? AND chunk_count IS NOT NULL",
+                (sha256,),
+            ).fetchone()
+
+    def begin(self, sha256: str, namespace: str, file_name: str) -> bool:
+        """
+        Mark an ingest as started (chunk_count NULL until `put`). Returns True
+        if an earlier ingest of the file never finished, so its namespace may
+        hold partial data.
+        """
+        with self.lock, self.conn:
+            unfinished = self.conn.execute(
+                "SELECT 1 FROM namespaces WHERE sha256 = ? AND chunk_count IS NULL", (sha256,)
+            ).fetchone() is not None
+            self.conn.execute(
+                "INSERT OR REPLACE INTO namespaces VALUES (?, ?, NULL, ?, ?)",
+                (sha256, namespace, file_name, time.time()),
+            )
+        return unfinished
+
+    def put(self, sha256: str, namespace: str, chunk_count: int, file_name: str):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO namespaces VALUES (?, ?, ?, ?, ?)",
+                (sha256, namespace, chunk_count, file_name, time.time()),
+            )
+
+    @contextmanager
+    def file_lock(self, sha256: str):
+        with self.lock:
+            entry = self._file_locks.setdefault(sha256, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._file_locks[sha256]
+
+    def record(self, hit: bool, file_name: str, seconds: float):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            total = self.hits + self.misses
+            print(
+                f"Namespace cache {'hit' if hit else 'miss'} for {file_name} in {seconds:.2f}s "
+                f"(hits={self.hits} misses={self.misses} hit_rate={self.hits / total:.0%})"
+            )
+
+
+namespace_registry = NamespaceRegistry()
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
 
 welcome_message = """Welcome to the Chainlit PDF QA demo! To get started:
 1. Upload a PDF or text file
@@ -37,34 +134,43 @@ def process_file(file: AskFileResponse):
     elif file.type == "application/pdf":
         Loader = PyPDFLoader
 
-        loader = Loader(file.path)
-        documents = loader.load()
-        docs = text_splitter.split_documents(documents)
-        for i, doc in enumerate(docs):
-            doc.metadata["source"] = f"source_{i}"
-        return docs
-
-
-def get_docsearch(file: AskFileResponse):
-    docs = process_file(file)
-
-    # Save data in the user session
-    cl.user_session.set("docs", docs)
+    loader = Loader(file.path)
+    documents = loader.load()
+    docs = text_splitter.split_documents(documents)
+    for i, doc in enumerate(docs):
+        doc.metadata["source"] = f"source_{i}"
+    return docs
+
+
+def get_docsearch(file: AskFileResponse) -> Tuple[Pinecone, bool]:
+    """Return the vector store for the file and whether it was already embedded"""
+    started = time.perf_counter()
+    # The namespace is derived from the content, not the per-upload file id
+    sha256 = file_sha256(file.path)
+    namespace = sha256
+
+    with namespace_registry.file_lock(sha256):
+        hit = namespace_registry.get(sha256) is not None
+        if hit:
+            docsearch = Pinecone.from_existing_index(
+                index_name=index_name, embedding=embeddings, namespace=namespace
+            )
+        else:
+            docs = process_file(file)
 
-    # Create a unique namespace for the file
-    namespace = file.id
+            # Save data in the user session
+            cl.user_session.set("docs", docs)
 
-    if namespace in namespaces:
-        docsearch = Pinecone.from_existing_index(
-            index_name=index_name, embedding=embeddings, namespace=namespace
-        )
-    else:
-        docsearch = Pinecone.from_documents(
-            docs, embeddings, index_name=index_name, namespace=namespace
-        )
-        namespaces.add(namespace)
+            # Drop whatever an interrupted earlier attempt left in the namespace
+            if namespace_registry.begin(sha256, namespace, file.name):
+                pinecone.Index(index_name).delete(delete_all=True, namespace=namespace)
+            docsearch = Pinecone.from_documents(
+                docs, embeddings, index_name=index_name, namespace=namespace
+            )
+            namespace_registry.put(sha256, namespace, len(docs), file.name)
 
-    return docsearch
+    namespace_registry.record(hit, file.name, time.perf_counter() - started)
+    return docsearch, hit
 
 
 @cl.on_chat_start
@@ -84,7 +190,7 @@ async def start():
     await msg.send()
 
     # No async implementation in the Pinecone client, fallback to sync
-    docsearch = await cl.make_async(get_docsearch)(file)
+    docsearch, cached = await cl.make_async(get_docsearch)(file)
 
     message_history = ChatMessageHistory()
 
@@ -104,7 +210,10 @@ async def start():
     )
 
     # Let the user know that the system is ready
-    msg.content = f"`{file.name}` processed. You can now ask questions!"
+    if cached:
+        msg.content = f"`{file.name}` was already processed. You can now ask questions!"
+    else:
+        msg.content = f"`{file.name}` processed. You can now ask questions!"
     await msg.update()
 
     cl.user_session.set("chain", chain)
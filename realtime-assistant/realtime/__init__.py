@@ -7,7 +7,8 @@ import numpy as np
 import json
 import websockets
 from datetime import datetime
-from collections import defaultdict
+import time
+from collections import defaultdict, deque
 import base64
 
 from chainlit.logger import logger
@@ -50,9 +51,235 @@ def array_buffer_to_base64(array_buffer):
     return base64.b64encode(array_buffer).decode("utf-8")
 
 
+class AudioRingBuffer:
+    """
+    Fixed-capacity ring buffer of int16 PCM samples.
+
+    Samples are addressed by their absolute index since the buffer was
+    created (`total_samples` is the index of the next sample to be written),
+    so callers can map server timestamps straight to samples. Only the most
+    recent `capacity` samples are kept, which bounds memory for long sessions.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self._data = np.zeros(self.capacity, dtype=np.int16)
+        self.total_samples = 0
+        self._odd_byte = b""
+
+    def __len__(self):
+        return min(self.total_samples, self.capacity)
+
+    @property
+    def start_sample(self):
+        """Absolute index of the oldest sample still held"""
+        return self.total_samples - len(self)
+
+    def append(self, pcm16_bytes):
+        """Append raw little-endian int16 PCM bytes"""
+        if self._odd_byte:
+            pcm16_bytes = self._odd_byte + bytes(pcm16_bytes)
+            self._odd_byte = b""
+        if len(pcm16_bytes) % 2:
+            self._odd_byte = bytes(pcm16_bytes[-1:])
+            pcm16_bytes = pcm16_bytes[:-1]
+        samples = np.frombuffer(pcm16_bytes, dtype=np.int16)
+        n = len(samples)
+        if n == 0:
+            return
+        if n > self.capacity:
+            # Only the tail can survive anyway
+            self.total_samples += n - self.capacity
+            samples = samples[-self.capacity:]
+            n = self.capacity
+        pos = self.total_samples % self.capacity
+        first = min(n, self.capacity - pos)
+        self._data[pos:pos + first] = samples[:first]
+        if first < n:
+            self._data[:n - first] = samples[first:]
+        self.total_samples += n
+
+    def view(self, start_sample, end_sample):
+        """
+        Return samples [start_sample, end_sample) as a bytes-like memoryview.
+
+        The range is clamped to what is still held. When it doesn't wrap around
+        the end of the ring the result is a zero-copy view, which stays valid
+        only until those samples are overwritten.
+        """
+        start = max(start_sample, self.start_sample)
+        end = min(end_sample, self.total_samples)
+        if end <= start:
+            return memoryview(b"")
+        a = start % self.capacity
+        b = a + (end - start)
+        if b <= self.capacity:
+            return memoryview(self._data[a:b]).cast("B")
+        wrapped = np.concatenate((self._data[a:], self._data[:b - self.capacity]))
+        return memoryview(wrapped).cast("B")
+
+
+class PCM16Buffer:
+    """
+    Growable, contiguous int16 PCM storage for one conversation item.
+
+    Appends are amortized O(1) (capacity doubles when full), truncation is
+    sample-accurate, and `view()` exposes the audio as bytes without copying.
+    """
+
+    def __init__(self, initial_capacity=4096):
+        self._data = np.empty(max(int(initial_capacity), 1), dtype=np.int16)
+        self._length = 0
+        self._odd_byte = b""
+
+    @classmethod
+    def from_bytes(cls, pcm16_bytes):
+        buffer = cls(len(pcm16_bytes) // 2)
+        buffer.append(pcm16_bytes)
+        return buffer
+
+    def __len__(self):
+        return self._length
+
+    def append(self, pcm16_bytes):
+        """Append raw little-endian int16 PCM bytes"""
+        if self._odd_byte:
+            pcm16_bytes = self._odd_byte + bytes(pcm16_bytes)
+            self._odd_byte = b""
+        if len(pcm16_bytes) % 2:
+            self._odd_byte = bytes(pcm16_bytes[-1:])
+            pcm16_bytes = pcm16_bytes[:-1]
+        samples = np.frombuffer(pcm16_bytes, dtype=np.int16)
+        end = self._length + len(samples)
+        if end > len(self._data):
+            grown = np.empty(max(end, 2 * len(self._data)), dtype=np.int16)
+            grown[:self._length] = self._data[:self._length]
+            self._data = grown
+        self._data[self._length:end] = samples
+        self._length = end
+
+    def truncate(self, sample_count):
+        """Keep only the first `sample_count` samples"""
+        self._length = max(0, min(self._length, int(sample_count)))
+        self._odd_byte = b""
+
+    def view(self):
+        """Zero-copy bytes-like view of the audio, valid until the next append"""
+        return memoryview(self._data[:self._length]).cast("B")
+
+    def tobytes(self):
+        return self._data[:self._length].tobytes()
+
+
+class DispatchQueue:
+    """
+    Ordered, bounded queue of pending async handler calls for one event name.
+
+    A single worker task runs the handlers one event at a time, so events of
+    the same type are handled in the order they arrived. When more than
+    `max_depth` events are pending the overflow policy applies:
+
+    - "drop": discard the oldest pending event
+    - "coalesce": merge the new event into the last pending one with
+      `coalesce(older, newer)`; if that returns None, fall back to "block"
+    - "block": keep the event; `wait_for_space()` lets the producer wait
+      until the queue is back under its bound
+    """
+
+    def __init__(self, name, max_depth, overflow, coalesce=None):
+        if overflow not in ("drop", "coalesce", "block"):
+            raise Exception(f'Unknown overflow policy "{overflow}"')
+        self.name = name
+        self.max_depth = max(int(max_depth), 1)
+        self.overflow = overflow
+        self.coalesce = coalesce or (lambda older, newer: newer)
+        self.pending = deque()  # [event, handlers, enqueued_at]
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._task = None
+        self.metrics = {
+            "dispatched": 0,
+            "processed": 0,
+            "dropped": 0,
+            "coalesced": 0,
+            "max_depth": 0,
+            "last_lag": 0.0,
+            "max_lag": 0.0,
+            "total_lag": 0.0,
+        }
+
+    def put(self, event, handlers):
+        self.metrics["dispatched"] += 1
+        if len(self.pending) >= self.max_depth:
+            if self.overflow == "drop":
+                self.pending.popleft()
+                self.metrics["dropped"] += 1
+            elif self.overflow == "coalesce":
+                last = self.pending[-1]
+                merged = self.coalesce(last[0], event)
+                if merged is not None:
+                    last[0], last[1] = merged, handlers
+                    self.metrics["coalesced"] += 1
+                    return
+        self.pending.append([event, handlers, time.monotonic()])
+        self.metrics["max_depth"] = max(self.metrics["max_depth"], len(self.pending))
+        if len(self.pending) >= self.max_depth:
+            self._space.clear()
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def discard(self, predicate):
+        """Drop pending events for which `predicate(event)` is true; returns how many"""
+        kept = deque(entry for entry in self.pending if not predicate(entry[0]))
+        discarded = len(self.pending) - len(kept)
+        self.pending = kept
+        self.metrics["dropped"] += discarded
+        if len(self.pending) < self.max_depth:
+            self._space.set()
+        return discarded
+
+    async def wait_for_space(self):
+        while len(self.pending) >= self.max_depth:
+            self._space.clear()
+            await self._space.wait()
+
+    async def _run(self):
+        while True:
+            while not self.pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            event, handlers, enqueued_at = self.pending.popleft()
+            if len(self.pending) < self.max_depth:
+                self._space.set()
+            lag = time.monotonic() - enqueued_at
+            self.metrics["processed"] += 1
+            self.metrics["last_lag"] = lag
+            self.metrics["max_lag"] = max(self.metrics["max_lag"], lag)
+            self.metrics["total_lag"] += lag
+            for handler in handlers:
+                try:
+                    await handler(event)
+                except Exception as e:
+                    logger.error(f'Error in "{self.name}" handler: {e}')
+
+    def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self.pending.clear()
+        self._space.set()
+
+
 class RealtimeEventHandler:
+    default_max_depth = 1024
+    default_overflow = "block"
+
     def __init__(self):
         self.event_handlers = defaultdict(list)
+        self.dispatch_policies = {}
+        self.dispatch_queues = {}
 
     def on(self, event_name, handler):
         self.event_handlers[event_name].append(handler)
@@ -60,12 +287,66 @@ class RealtimeEventHandler:
     def clear_event_handlers(self):
         self.event_handlers = defaultdict(list)
 
+    def set_dispatch_policy(self, event_name, max_depth=None, overflow=None, coalesce=None):
+        """Configure the queue bound and overflow policy for async handlers of `event_name`"""
+        self.dispatch_policies[event_name] = {
+            "max_depth": max_depth or self.default_max_depth,
+            "overflow": overflow or self.default_overflow,
+            "coalesce": coalesce,
+        }
+        queue = self.dispatch_queues.pop(event_name, None)
+        if queue:
+            queue.close()
+
+    def _get_dispatch_queue(self, event_name):
+        queue = self.dispatch_queues.get(event_name)
+        if queue is None:
+            policy = self.dispatch_policies.get(event_name, {})
+            queue = DispatchQueue(
+                event_name,
+                policy.get("max_depth", self.default_max_depth),
+                policy.get("overflow", self.default_overflow),
+                policy.get("coalesce"),
+            )
+            self.dispatch_queues[event_name] = queue
+        return queue
+
     def dispatch(self, event_name, event):
+        async_handlers = []
         for handler in self.event_handlers[event_name]:
             if inspect.iscoroutinefunction(handler):
-                asyncio.create_task(handler(event))
+                async_handlers.append(handler)
             else:
                 handler(event)
+        if async_handlers:
+            self._get_dispatch_queue(event_name).put(event, async_handlers)
+
+    def discard_pending(self, event_name, predicate):
+        """Drop queued, not yet handled `event_name` events matching `predicate`"""
+        queue = self.dispatch_queues.get(event_name)
+        return queue.discard(predicate) if queue else 0
+
+    async def drain(self):
+        """Wait until every queue is back under its bound (backpressure for producers)"""
+        for queue in list(self.dispatch_queues.values()):
+            if queue.overflow != "drop":
+                await queue.wait_for_space()
+
+    def dispatch_metrics(self):
+        metrics = {}
+        for name, queue in self.dispatch_queues.items():
+            processed = queue.metrics["processed"]
+            metrics[name] = {
+                **queue.metrics,
+                "depth": len(queue.pending),
+                "avg_lag": queue.metrics["total_lag"] / processed if processed else 0.0,
+            }
+        return metrics
+
+    def close_dispatch_queues(self):
+        for queue in self.dispatch_queues.values():
+            queue.close()
+        self.dispatch_queues = {}
 
     async def wait_for_next(self, event_name):
         future = asyncio.Future()
@@ -85,6 +366,8 @@ class RealtimeAPI(RealtimeEventHandler):
         self.url = url or self.default_url
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         self.ws = None
+        # Handlers whose queues should throttle reading from the websocket
+        self.downstream_handlers = []
 
     def is_connected(self):
         return self.ws is not None
@@ -110,6 +393,9 @@ class RealtimeAPI(RealtimeEventHandler):
             self.log("received:", event)
             self.dispatch(f"server.{event['type']}", event)
             self.dispatch("server.*", event)
+            # Stop reading while a slow consumer catches up
+            for handler in (self, *self.downstream_handlers):
+                await handler.drain()
 
     async def send(self, event_name, data=None):
         if not self.is_connected():
@@ -123,6 +409,23 @@ class RealtimeAPI(RealtimeEventHandler):
         self.log("sent:", event)
         await self.ws.send(json.dumps(event))
 
+    async def send_input_audio(self, pcm16_bytes):
+        """
+        Fast path for "input_audio_buffer.append": the payload is plain base64,
+        so the frame is formatted directly instead of going through json.dumps.
+        """
+        if not self.is_connected():
+            raise Exception("RealtimeAPI is not connected")
+        event_id = self._generate_id("evt_")
+        audio = base64.b64encode(pcm16_bytes).decode("ascii")
+        event = {"event_id": event_id, "type": "input_audio_buffer.append", "audio": audio}
+        self.dispatch("client.input_audio_buffer.append", event)
+        self.dispatch("client.*", event)
+        await self.ws.send(
+            '{"event_id":"%s","type":"input_audio_buffer.append","audio":"%s"}'
+            % (event_id, audio)
+        )
+
     def _generate_id(self, prefix):
         return f"{prefix}{int(datetime.utcnow().timestamp() * 1000)}"
 
@@ -131,6 +434,7 @@ class RealtimeAPI(RealtimeEventHandler):
             await self.ws.close()
             self.ws = None
             self.log(f"Disconnected from {self.url}")
+        self.close_dispatch_queues()
 
 
 class RealtimeConversation:
@@ -202,11 +506,11 @@ class RealtimeConversation:
         if new_item["id"] not in self.item_lookup:
             self.item_lookup[new_item["id"]] = new_item
             self.items.append(new_item)
-        new_item["formatted"] = {"audio": [], "text": "", "transcript": ""}
+        new_item["formatted"] = {"audio": PCM16Buffer(), "text": "", "transcript": ""}
         if new_item["id"] in self.queued_speech_items:
-            new_item["formatted"]["audio"] = self.queued_speech_items[new_item["id"]][
-                "audio"
-            ]
+            new_item["formatted"]["audio"] = PCM16Buffer.from_bytes(
+                self.queued_speech_items[new_item["id"]].get("audio", b"")
+            )
             del self.queued_speech_items[new_item["id"]]
         if "content" in new_item:
             text_content = [
@@ -223,7 +527,9 @@ class RealtimeConversation:
             if new_item["role"] == "user":
                 new_item["status"] = "completed"
                 if self.queued_input_audio:
-                    new_item["formatted"]["audio"] = self.queued_input_audio
+                    new_item["formatted"]["audio"] = PCM16Buffer.from_bytes(
+                        self.queued_input_audio
+                    )
                     self.queued_input_audio = None
             else:
                 new_item["status"] = "in_progress"
@@ -248,7 +554,7 @@ class RealtimeConversation:
             raise Exception(f'item.truncated: Item "{item_id}" not found')
         end_index = (audio_end_ms * self.default_frequency) // 1000
         item["formatted"]["transcript"] = ""
-        item["formatted"]["audio"] = item["formatted"]["audio"][:end_index]
+        item["formatted"]["audio"].truncate(end_index)
         return item, None
 
     def _process_item_deleted(self, event):
@@ -287,7 +593,8 @@ class RealtimeConversation:
         if input_audio_buffer:
             start_index = (speech["audio_start_ms"] * self.default_frequency) // 1000
             end_index = (speech["audio_end_ms"] * self.default_frequency) // 1000
-            speech["audio"] = input_audio_buffer[start_index:end_index]
+            # Copy the segment: the item outlives the ring buffer's contents
+            speech["audio"] = input_audio_buffer.view(start_index, end_index).tobytes()
         return None, None
 
     def _process_response_created(self, event):
@@ -348,9 +655,8 @@ class RealtimeConversation:
         if not item:
             logger.debug(f'response.audio.delta: Item "{item_id}" not found')
             return None, None
-        array_buffer = base64_to_array_buffer(delta)
-        append_values = array_buffer.tobytes()
-        item["formatted"]["audio"] += [append_values]
+        append_values = base64.b64decode(delta)
+        item["formatted"]["audio"].append(append_values)
         return item, {"audio": append_values}
 
     def _process_text_delta(self, event):
@@ -377,7 +683,25 @@ class RealtimeConversation:
         return item, {"arguments": delta}
 
 
+def _is_audio_update(event):
+    return set(event.get("delta") or {}) == {"audio"}
+
+
+def _coalesce_audio_updates(older, newer):
+    """Merge two pending audio-only "conversation.updated" events for the same item"""
+    if (
+        _is_audio_update(older)
+        and _is_audio_update(newer)
+        and older["item"]["id"] == newer["item"]["id"]
+    ):
+        return {"item": newer["item"], "delta": {"audio": older["delta"]["audio"] + newer["delta"]["audio"]}}
+    return None
+
+
 class RealtimeClient(RealtimeEventHandler):
+    input_audio_buffer_seconds = 120
+    input_audio_frame_ms = 100  # outbound audio is sent in frames of this duration
+
     def __init__(self, url=None, api_key=None):
         super().__init__()
         self.default_session_config = {
@@ -402,7 +726,15 @@ class RealtimeClient(RealtimeEventHandler):
             "silence_duration_ms": 200,
         }
         self.realtime = RealtimeAPI(url, api_key)
+        self.realtime.downstream_handlers.append(self)
         self.conversation = RealtimeConversation()
+        # Audio deltas for the same item can be merged losslessly when the client falls behind
+        self.set_dispatch_policy(
+            "conversation.updated",
+            max_depth=64,
+            overflow="coalesce",
+            coalesce=_coalesce_audio_updates,
+        )
         self._reset_config()
         self._add_api_event_handlers()
 
@@ -410,7 +742,11 @@ class RealtimeClient(RealtimeEventHandler):
         self.session_created = False
         self.tools = {}
         self.session_config = self.default_session_config.copy()
-        self.input_audio_buffer = bytearray()
+        self.input_audio_buffer = AudioRingBuffer(
+            self.input_audio_buffer_seconds * self.conversation.default_frequency
+        )
+        self.input_audio_committed = 0  # sample index of the last manual commit
+        self.outbound_audio = bytearray()  # PCM not yet sent to the server
         return True
 
     def _add_api_event_handlers(self):
@@ -460,6 +796,10 @@ class RealtimeClient(RealtimeEventHandler):
 
     def _on_speech_started(self, event):
         self._process_event(event)
+        # Queues are per event type, so audio still waiting in the
+        # "conversation.updated" queue would otherwise be played after the
+        # interrupt, on the new track
+        self.discard_pending("conversation.updated", _is_audio_update)
         self.dispatch("conversation.interrupted", event)
 
     def _on_speech_stopped(self, event):
@@ -536,8 +876,11 @@ class RealtimeClient(RealtimeEventHandler):
     async def disconnect(self):
         self.session_created = False
         self.conversation.clear()
+        self.outbound_audio.clear()
         if self.realtime.is_connected():
             await self.realtime.disconnect()
+        logger.debug(f"Realtime dispatch metrics: {self.dispatch_metrics()}")
+        self.close_dispatch_queues()
 
     def get_turn_detection_type(self):
         return self.session_config.get("turn_detection", {}).get("type")
@@ -603,20 +946,34 @@ class RealtimeClient(RealtimeEventHandler):
 
     async def append_input_audio(self, array_buffer):
         if len(array_buffer) > 0:
-            await self.realtime.send(
-                "input_audio_buffer.append",
-                {
-                    "audio": array_buffer_to_base64(np.array(array_buffer)),
-                },
-            )
-            self.input_audio_buffer.extend(array_buffer)
+            self.input_audio_buffer.append(array_buffer)
+            self.outbound_audio.extend(array_buffer)
+            frame_bytes = (
+                self.conversation.default_frequency * self.input_audio_frame_ms // 1000
+            ) * 2
+            if len(self.outbound_audio) >= frame_bytes:
+                await self.flush_input_audio()
+        return True
+
+    async def flush_input_audio(self):
+        """Send any buffered microphone audio as a single append"""
+        if self.outbound_audio:
+            pcm = bytes(self.outbound_audio)
+            self.outbound_audio.clear()
+            await self.realtime.send_input_audio(pcm)
         return True
 
     async def create_response(self):
-        if self.get_turn_detection_type() is None and len(self.input_audio_buffer) > 0:
+        await self.flush_input_audio()
+        uncommitted = self.input_audio_buffer.total_samples - self.input_audio_committed
+        if self.get_turn_detection_type() is None and uncommitted > 0:
             await self.realtime.send("input_audio_buffer.commit")
-            self.conversation.queue_input_audio(self.input_audio_buffer)
-            self.input_audio_buffer = bytearray()
+            self.conversation.queue_input_audio(
+                self.input_audio_buffer.view(
+                    self.input_audio_committed, self.input_audio_buffer.total_samples
+                ).tobytes()
+            )
+            self.input_audio_committed = self.input_audio_buffer.total_samples
         await self.realtime.send("response.create")
         return True
 